@@ -1,9 +1,12 @@
-from maze_environment import load_level, show_level, save_level_costs
+from maze_environment import load_level, show_level, save_level_costs, load_grid, show_grid, save_grid_costs
 from math import inf, sqrt
 from heapq import heappop, heappush
+from array import array
 
+import numpy
 
-def dijkstras_shortest_path(initial_position, destination, graph, adj):
+
+def dijkstras_shortest_path(initial_position, destination, graph, adj, stats=None):
     """ Searches for a minimal cost path through a graph using Dijkstra's algorithm.
 
     Args:
@@ -11,21 +14,37 @@ def dijkstras_shortest_path(initial_position, destination, graph, adj):
         destination: The end location for the path.
         graph: A loaded level, containing walls, spaces, and waypoints.
         adj: An adjacency function returning cells adjacent to a given cell as well as their respective edge costs.
+        stats: An optional nm_stats.SearchStats (see src/nm_stats.py) to record the search's counters and timings
+            in; heap operations then go through it.
 
     Returns:
         If a path exits, return a list containing all cells from initial_position to destination.
         Otherwise, return None.
 
     """
+    if stats is None:
+        push, pop = heappush, heappop
+    else:
+        stats.begin()
+        push, pop = stats.push, stats.pop
+
     paths = {initial_position: []}          # maps cells to previous cells on path
     pathcosts = {initial_position: 0}       # maps cells to their pathcosts (found so far)
     queue = []
-    heappush(queue, (0, initial_position))  # maintain a priority queue of cells
+    push(queue, (0, initial_position))      # maintain a priority queue of cells
     
     while queue:
-        priority, cell = heappop(queue)
+        priority, cell = pop(queue)
+        if priority > pathcosts[cell]:
+            # left behind by a cheaper path found since
+            if stats is not None:
+                stats.stale_pops += 1
+            continue
         if cell == destination:
-            return path_to_cell(cell, paths)
+            path = path_to_cell(cell, paths)
+            if stats is not None:
+                stats.finish(path, priority)
+            return path
         
         # investigate children
         for (child, step_cost) in adj(graph, cell):
@@ -34,15 +53,331 @@ def dijkstras_shortest_path(initial_position, destination, graph, adj):
             if child not in pathcosts or cost_to_child < pathcosts[child]:
                 pathcosts[child] = cost_to_child            # update the cost
                 paths[child] = cell                         # set the backpointer
-                heappush(queue, (cost_to_child, child))     # put the child on the priority queue
+                push(queue, (cost_to_child, child))         # put the child on the priority queue
             
+    if stats is not None:
+        stats.finish([], 0)
     return False
 
 def path_to_cell(cell, paths):
-    if cell == []:
-        return []
-    return path_to_cell(paths[cell], paths) + [cell]
-    
+    path = []
+    while cell != []:
+        path.append(cell)
+        cell = paths[cell]
+    path.reverse()
+    return path
+
+
+def dijkstras_shortest_path_grid(initial_position, destination, grid):
+    """ Searches for a minimal cost path through a grid loaded by load_grid using Dijkstra's algorithm.
+
+    Finds the same path as dijkstras_shortest_path with navigation_edges, with cells as flat indices
+    into a padded copy of the cost array and distances and parents in preallocated arrays.
+
+    Args:
+        initial_position: The initial cell from which the path extends.
+        destination: The end location for the path.
+        grid: A loaded grid, containing costs, walls, and waypoints.
+
+    Returns:
+        If a path exits, return a list containing all cells from initial_position to destination.
+        Otherwise, return False.
+
+    """
+    flat = grid_graph(grid)
+    stride = flat['stride']
+    target = flat_index(destination, stride)
+
+    pathcosts, paths = _search_grid(flat, flat_index(initial_position, stride), target)
+    if pathcosts[target] == inf:
+        return False
+
+    path = []
+    cell = target
+    while cell != -1:
+        path.append(cell_of(cell, stride))
+        cell = paths[cell]
+    path.reverse()
+    return path
+
+
+def dijkstras_distance_map(initial_position, graph, adj):
+    """ Computes the minimal path cost from initial_position to every reachable cell using Dijkstra's algorithm.
+
+    Args:
+        initial_position: The initial cell from which the paths extend.
+        graph: A loaded level, containing walls, spaces, and waypoints.
+        adj: An adjacency function returning cells adjacent to a given cell as well as their respective edge costs.
+
+    Returns:
+        A dictionary mapping every reachable cell to its path cost, ready for save_level_costs.
+
+    """
+    pathcosts = {initial_position: 0}
+    queue = [(0, initial_position)]
+
+    while queue:
+        priority, cell = heappop(queue)
+        if priority > pathcosts[cell]:
+            continue
+
+        for (child, step_cost) in adj(graph, cell):
+            cost_to_child = priority + transition_cost(graph, cell, child)
+            if child not in pathcosts or cost_to_child < pathcosts[child]:
+                pathcosts[child] = cost_to_child
+                heappush(queue, (cost_to_child, child))
+
+    return pathcosts
+
+
+def distance_map_grid(initial_position, grid):
+    """ Computes the minimal path cost from initial_position to every cell of a grid loaded by load_grid.
+
+    Returns:
+        A float array indexed [i, j] like the grid's cells, inf where a cell cannot be reached; see save_grid_costs.
+
+    """
+    flat = grid_graph(grid)
+    pathcosts, _ = _search_grid(flat, flat_index(initial_position, flat['stride']))
+    padded = numpy.frombuffer(pathcosts, dtype=numpy.float64).reshape(-1, flat['stride'])
+    return padded[1:-1, 1:-1].copy()
+
+
+def _search_grid(flat, source, target=-1):
+    # Dijkstra over the flat grid from source until target is expanded, or over everything reachable
+    cost, edges = flat['cost'], flat['edges']
+
+    pathcosts = array('d', [inf]) * len(cost)   # maps cells to their pathcosts (found so far)
+    paths = array('l', [-1]) * len(cost)        # maps cells to previous cells on path
+    pathcosts[source] = 0
+    queue = [(0, source)]
+
+    while queue:
+        priority, cell = heappop(queue)
+        if cell == target:
+            break
+        if priority > pathcosts[cell]:
+            continue  # a cheaper route to this cell was already expanded
+
+        cell_cost = cost[cell]
+        for offset, distance in edges:
+            child = cell + offset
+            child_cost = cost[child]
+            if child_cost == inf:
+                continue
+            cost_to_child = priority + distance * (cell_cost + child_cost) / 2
+            if cost_to_child < pathcosts[child]:
+                pathcosts[child] = cost_to_child
+                paths[child] = cell
+                heappush(queue, (cost_to_child, child))
+
+    return pathcosts, paths
+
+
+def grid_graph(grid):
+    """ Returns the flat form of a grid that dijkstras_shortest_path_grid searches, building it on first use.
+
+    The cost array is padded with a border of impassable cells, so the 8 neighbors of any cell are at
+    fixed offsets from its flat index and never wrap around a row.
+    """
+    if 'flat' not in grid:
+        padded = numpy.pad(grid['costs'], 1, constant_values=inf)
+        stride = padded.shape[1]
+        edges = [(x * stride + y, sqrt(x * x + y * y)) for x in [-1, 0, 1] for y in [-1, 0, 1] if not (x == 0 and y == 0)]
+
+        # cost-1 cells whose neighbors all cost 1 or cannot be entered: the cells jump_point_search_grid jumps over
+        unit = padded == 1
+        settled = unit | (padded == inf)
+        plain = unit.copy()
+        for x in [-1, 0, 1]:
+            for y in [-1, 0, 1]:
+                plain[1:-1, 1:-1] &= settled[1 + x:settled.shape[0] - 1 + x, 1 + y:settled.shape[1] - 1 + y]
+
+        grid['flat'] = {'cost': array('f', padded.tobytes()), 'stride': stride, 'edges': edges,
+                        'plain': bytearray(plain.tobytes())}
+    return grid['flat']
+
+
+def jump_point_search_grid(initial_position, destination, grid):
+    """ Searches a grid loaded by load_grid like dijkstras_shortest_path_grid, jumping across uniform-cost areas.
+
+    Cells of cost 1 surrounded only by cost-1 cells and cells that cannot be entered are searched with Jump Point
+    Search: from such a cell the search only follows the directions a shortest path can continue in, and slides
+    along each to the next cell where the path might have to turn, in one step using the distances precomputed by
+    jump_distances (JPS+). Like navigation_edges, diagonal moves may cut wall corners, so the forced-neighbor rules
+    are those of the original corner-cutting JPS. Every other cell is expanded to all 8 neighbors at its
+    transition_cost, and jumps stop on reaching one, so path costs stay optimal.
+
+    Args:
+        initial_position: The initial cell from which the path extends.
+        destination: The end location for the path.
+        grid: A loaded grid, containing costs, walls, and waypoints.
+
+    Returns:
+        If a path exits, return a list containing all cells from initial_position to destination.
+        Otherwise, return False.
+
+    """
+    flat = grid_graph(grid)
+    cost, stride, edges, plain = flat['cost'], flat['stride'], flat['edges'], flat['plain']
+    jumps = jump_distances(grid)
+
+    source = flat_index(initial_position, stride)
+    target = flat_index(destination, stride)
+    tx, ty = destination
+
+    def successors(cell, parent):
+        x, y = cell_of(cell, stride)
+        if parent == -1:
+            moves = MOVES
+        else:
+            px, py = cell_of(parent, stride)
+            moves = pruned_moves(cell, (x > px) - (x < px), (y > py) - (y < py))
+
+        found = []
+        for dx, dy in moves:
+            k = jumps[dx, dy][cell]
+            reach = k if k > 0 else -k - 1  # steps that can be taken in this direction
+
+            # the target, or the cell in line with it, cuts the jump short
+            if dx and dy:
+                ahead = min((tx - x) * dx, (ty - y) * dy)
+            elif dx:
+                ahead = (tx - x) * dx if ty == y else 0
+            else:
+                ahead = (ty - y) * dy if tx == x else 0
+            if 0 < ahead <= reach:
+                k = ahead
+            elif k <= 0:
+                continue
+
+            found.append((cell + k * (dx * stride + dy), k * (SQRT2 if dx and dy else 1)))
+        return found
+
+    def pruned_moves(cell, dx, dy):
+        # the moves a shortest path arriving in direction (dx, dy) may continue with
+        if dx == 0 or dy == 0:
+            found = [(dx, dy)]
+            for sx, sy in ((dy, dx), (-dy, -dx)):
+                if cost[cell + sx * stride + sy] == inf:
+                    found.append((dx + sx, dy + sy))
+            return found
+        found = [(dx, 0), (0, dy), (dx, dy)]
+        if cost[cell - dx * stride] == inf:
+            found.append((-dx, dy))
+        if cost[cell - dy] == inf:
+            found.append((dx, -dy))
+        return found
+
+    pathcosts = {source: 0}     # maps jump points to their pathcosts (found so far)
+    paths = {source: -1}        # maps jump points to the previous jump point on the path
+    queue = [(0, source)]
+
+    while queue:
+        priority, cell = heappop(queue)
+        if cell == target:
+            return _interpolate(cell, paths, stride)
+        if priority > pathcosts[cell]:
+            continue  # a cheaper route to this cell was already expanded
+
+        if plain[cell]:
+            children = successors(cell, paths[cell])
+        else:
+            cell_cost = cost[cell]
+            children = [(cell + offset, distance * (cell_cost + cost[cell + offset]) / 2)
+                        for offset, distance in edges if cost[cell + offset] != inf]
+
+        for child, step_cost in children:
+            cost_to_child = priority + step_cost
+            if cost_to_child < pathcosts.get(child, inf):
+                pathcosts[child] = cost_to_child
+                paths[child] = cell
+                heappush(queue, (cost_to_child, child))
+
+    return False
+
+
+def jump_distances(grid):
+    """ Precomputes, for every cell and each of the 8 directions, how far a jump from it goes (JPS+).
+
+    A jump stops at the first cell that is not plain (see grid_graph) or has a forced neighbor, and a diagonal
+    jump also at the first cell from which one of its two straight component jumps stops somewhere. k > 0 means
+    the jump stops k steps away; k < 0 means a cell that cannot be entered lies -k steps away first, so only
+    -k - 1 steps can be taken.
+
+    Returns:
+        A dict from (dx, dy) to an array of jump distances by flat index, cached with the grid's flat form.
+    """
+    flat = grid_graph(grid)
+    if 'jumps' in flat:
+        return flat['jumps']
+
+    shape = (len(flat['cost']) // flat['stride'], flat['stride'])
+    passable = numpy.frombuffer(flat['cost'], dtype=numpy.float32).reshape(shape) != inf
+    plain = numpy.frombuffer(flat['plain'], dtype=numpy.uint8).reshape(shape).astype(bool)
+    indices = numpy.arange(passable.size).reshape(shape)
+
+    def at(x, y):
+        # passable, looked up at (i + x, j + y) for every cell (i, j); the padding keeps this off the edges
+        return numpy.roll(passable, (-x, -y), axis=(0, 1))
+
+    distances = {}
+    for dx, dy in sorted(MOVES, key=lambda move: abs(move[0] * move[1])):  # straight moves first
+        if dx and dy:
+            forced = (~at(-dx, 0) & at(-dx, dy)) | (~at(0, -dy) & at(dx, -dy))
+            forced |= (distances[dx, 0] > 0).reshape(shape) | (distances[0, dy] > 0).reshape(shape)
+        else:
+            px, py = dy, dx  # perpendicular to the move
+            forced = (~at(px, py) & at(px + dx, py + dy)) | (~at(-px, -py) & at(dx - px, dy - py))
+        stop = passable & (~plain | forced)
+
+        lines = indices[::-1 if dx < 0 else 1, ::-1 if dy < 0 else 1]
+        if dx and dy:
+            lines = [lines.diagonal(offset) for offset in range(1 - shape[0], shape[1])]
+        elif dx:
+            lines = lines.T
+
+        found = numpy.zeros(passable.size, dtype=numpy.int32)
+        for line in lines:
+            ends = ~passable.flat[line] | stop.flat[line]
+            positions = numpy.arange(len(line))
+            following = numpy.minimum.accumulate(numpy.where(ends, positions, len(line))[::-1])[::-1]
+            following = numpy.append(following[1:], len(line))  # the first end strictly ahead
+            steps = following - positions
+            stops = stop.flat[line[numpy.minimum(following, len(line) - 1)]] & (following < len(line))
+            found[line] = numpy.where(stops, steps, -steps)
+        distances[dx, dy] = found
+
+    flat['jumps'] = {move: array('i', found.tobytes()) for move, found in distances.items()}
+    return flat['jumps']
+
+
+MOVES = [(x, y) for x in [-1, 0, 1] for y in [-1, 0, 1] if not (x == 0 and y == 0)]
+SQRT2 = sqrt(2)
+
+
+def _interpolate(cell, paths, stride):
+    # fill in the straight and diagonal runs between jump points
+    points = []
+    while cell != -1:
+        points.append(cell_of(cell, stride))
+        cell = paths[cell]
+    points.reverse()
+
+    path = points[:1]
+    for (x1, y1), (x2, y2) in zip(points, points[1:]):
+        dx, dy = (x2 > x1) - (x2 < x1), (y2 > y1) - (y2 < y1)
+        for k in range(1, max(abs(x2 - x1), abs(y2 - y1)) + 1):
+            path.append((x1 + k * dx, y1 + k * dy))
+    return path
+
+
+def flat_index(cell, stride):
+    return (cell[0] + 1) * stride + cell[1] + 1
+
+
+def cell_of(index, stride):
+    return index // stride - 1, index % stride - 1
 
 
 
@@ -76,16 +411,29 @@ def transition_cost(level, cell, cell2):
     return distance * average_cost
 
 
-def test_route(filename, src_waypoint, dst_waypoint):
+def test_route(filename, src_waypoint, dst_waypoint, grid=False, jump=False):
     """ Loads a level, searches for a path between the given waypoints, and displays the result.
 
     Args:
         filename: The name of the text file containing the level.
         src_waypoint: The character associated with the initial waypoint.
         dst_waypoint: The character associated with the destination waypoint.
+        grid: Load the level into NumPy arrays and search it with dijkstras_shortest_path_grid.
+        jump: Load the level into NumPy arrays and search it with jump_point_search_grid.
 
     """
 
+    if grid or jump:
+        level = load_grid(filename)
+        show_grid(level)
+        search = jump_point_search_grid if jump else dijkstras_shortest_path_grid
+        path = search(level['waypoints'][src_waypoint], level['waypoints'][dst_waypoint], level)
+        if path:
+            show_grid(level, path)
+        else:
+            print("No path possible!")
+        return
+
     # Load and display the level.
     level = load_level(filename)
     show_level(level)
@@ -102,6 +450,25 @@ def test_route(filename, src_waypoint, dst_waypoint):
         print("No path possible!")
 
 
+def test_distance_map(filename, src_waypoint, out_filename='distance_map.csv', grid=False):
+    """ Loads a level and saves the cost of reaching every cell from the given waypoint.
+
+    Args:
+        filename: The name of the text file containing the level.
+        src_waypoint: The character associated with the initial waypoint.
+        out_filename: The .csv or .npy file to save the costs to.
+        grid: Load the level into NumPy arrays and use distance_map_grid.
+
+    """
+    if grid:
+        level = load_grid(filename)
+        save_grid_costs(distance_map_grid(level['waypoints'][src_waypoint], level), out_filename)
+    else:
+        level = load_level(filename)
+        costs = dijkstras_distance_map(level['waypoints'][src_waypoint], level, navigation_edges)
+        save_level_costs(level, costs, out_filename)
+
+
 if __name__ == '__main__':
     filename, src_waypoint, dst_waypoint = 'example.txt', 'a','e'
 
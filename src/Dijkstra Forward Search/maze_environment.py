@@ -3,8 +3,16 @@
 from math import inf
 from csv import writer
 
+import numpy
+
 WALL = 'X'
 
+# Byte value -> cell cost in grid form: digits cost their value, waypoints (lowercase letters) cost 1,
+# and everything else, walls included, cannot be entered.
+COST_LUT = numpy.full(256, inf, dtype=numpy.float32)
+COST_LUT[ord('0'):ord('9') + 1] = numpy.arange(10)
+COST_LUT[ord('a'):ord('z') + 1] = 1
+
 
 def load_level(filename):
     """ Loads a level from a given text file.
@@ -41,6 +49,96 @@ def load_level(filename):
     return level
 
 
+def load_grid(filename, chunk_size=1 << 22):
+    """ Loads a level from a given text file into NumPy arrays.
+
+    The file is memory-mapped rather than read, and converted a block of lines at a time: each line's bytes
+    are mapped straight to costs through COST_LUT and waypoints are picked out of the block, so neither the
+    text nor per-cell Python objects are ever held whole. The grid takes a few bytes per cell instead of a
+    tuple key, a dict entry and a float object per cell; grid_to_level gives the dict-based view of it.
+
+    Args:
+        filename: The name of the txt file containing the maze.
+        chunk_size: About how many bytes of the file to convert at a time.
+
+    Returns:
+        The loaded grid (dict) containing the costs of cells (float32 array indexed [i, j] like the cells
+        of load_level, inf where a cell cannot be entered), the locations of walls (bool array), and a
+        mapping of locations to waypoints (dict).
+
+    """
+    with open(filename, "rb") as f:
+        f.seek(0, 2)
+        size = f.tell()
+    data = numpy.memmap(filename, dtype=numpy.uint8, mode='r') if size else numpy.zeros(0, dtype=numpy.uint8)
+
+    # line ends, found a chunk at a time; a last line without a newline ends with the file
+    ends = [numpy.flatnonzero(data[start:start + chunk_size] == ord('\n')) + start
+            for start in range(0, size, chunk_size)]
+    ends = numpy.concatenate(ends) if ends else numpy.zeros(0, dtype=numpy.int64)
+    if size and (not len(ends) or ends[-1] != size - 1):
+        ends = numpy.append(ends, size)
+    starts = numpy.concatenate(([0], ends[:-1] + 1))[:len(ends)].astype(numpy.int64)  # an empty file has no lines
+    stops = ends - ((ends > starts) & (data[numpy.maximum(ends - 1, 0)] == ord('\r')))  # drop \r of \r\n
+    lengths = stops - starts
+
+    height = len(lengths)
+    width = int(lengths.max()) if height else 0
+    costs = numpy.empty((width, height), dtype=numpy.float32)
+    walls = numpy.empty((width, height), dtype=bool)
+    waypoints = {}
+
+    columns = numpy.arange(width)
+    block_rows = max(1, chunk_size // max(width, 1))
+    for j0 in range(0, height, block_rows):
+        j1 = min(height, j0 + block_rows)
+        offsets = starts[j0:j1, None] + columns
+        inside = columns < lengths[j0:j1, None]
+        chars = numpy.where(inside, data[numpy.minimum(offsets, max(size - 1, 0))], ord(' ')).astype(numpy.uint8)
+
+        costs[:, j0:j1] = COST_LUT[chars].T
+        walls[:, j0:j1] = (chars == ord(WALL)).T
+        for j, i in zip(*numpy.nonzero((chars >= ord('a')) & (chars <= ord('z')))):
+            waypoints[chr(chars[j, i])] = (int(i), int(j0 + j))
+
+    grid = {'costs': costs,
+            'walls': walls,
+            'waypoints': waypoints}
+
+    return grid
+
+
+def grid_to_level(grid):
+    """ Converts a grid loaded by load_grid into the dict-based level of load_level. """
+    costs = grid['costs']
+    i, j = numpy.nonzero(costs != inf)
+    spaces = dict(zip(zip(i.tolist(), j.tolist()), costs[i, j].astype(float).tolist()))
+    i, j = numpy.nonzero(grid['walls'])
+    walls = set(zip(i.tolist(), j.tolist()))
+
+    level = {'walls': walls,
+             'spaces': spaces,
+             'waypoints': dict(grid['waypoints'])}
+
+    return level
+
+
+def level_to_grid(level):
+    """ Converts a level loaded by load_level into the grid form of load_grid. """
+    cells = list(level['spaces']) + list(level['walls'])
+    width = max((i for i, j in cells), default=-1) + 1
+    height = max((j for i, j in cells), default=-1) + 1
+
+    costs = numpy.full((width, height), inf, dtype=numpy.float32)
+    for cell, cost in level['spaces'].items():
+        costs[cell] = cost
+    walls = numpy.zeros((width, height), dtype=bool)
+    for cell in level['walls']:
+        walls[cell] = True
+
+    return {'costs': costs, 'walls': walls, 'waypoints': dict(level['waypoints'])}
+
+
 def show_level(level, path=[]):
     """ Displays a level via a print statement.
 
@@ -78,36 +176,90 @@ def show_level(level, path=[]):
     print(''.join(chars))
 
 
+def show_grid(grid, path=[]):
+    """ Displays a grid loaded by load_grid via a print statement, as show_level does for levels.
+
+    Args:
+        grid: The grid to be displayed.
+        path: A continuous path to be displayed over the grid, if provided.
+
+    """
+    costs, walls = grid['costs'], grid['walls']
+    path_cells = set(path)
+    inverted_waypoints = {point: char for char, point in grid['waypoints'].items()}
+
+    chars = []
+    for j in range(costs.shape[1]):
+        for i in range(costs.shape[0]):
+
+            cell = (i, j)
+            if cell in path_cells:
+                chars.append('*')
+            elif walls[cell]:
+                chars.append('X')
+            elif cell in inverted_waypoints:
+                chars.append(inverted_waypoints[cell])
+            elif costs[cell] != inf:
+                chars.append(str(int(costs[cell])))
+            else:
+                chars.append(' ')
+
+        chars.append('\n')
+
+    print(''.join(chars))
+
+
 def save_level_costs(level, costs, filename='distance_map.csv'):
     """ Displays cell costs from an origin point over the given level.
 
+    Rows are written to the csv file as they are produced, so the whole table is never held in memory.
+
     Args:
         level: The level to be displayed.
         costs: A dictionary containing a mapping of cells to costs from an origin point.
-        filename: The name of the csv file to be created.
+        filename: The name of the csv file to be created, or of a .npy file to store the table as a float array
+            with one row per csv line.
 
     """
     xs, ys = zip(*(list(level['spaces'].keys()) + list(level['walls'])))
     x_lo, x_hi = min(xs), max(xs)
     y_lo, y_hi = min(ys), max(ys)
 
-    rows = []
-    for j in range(y_lo, y_hi + 1):
-        row = []
+    if filename.endswith('.npy'):
+        table = numpy.full((y_hi - y_lo + 1, x_hi - x_lo + 1), inf)
+        for (i, j), cost in costs.items():
+            if x_lo <= i <= x_hi and y_lo <= j <= y_hi:
+                table[j - y_lo, i - x_lo] = cost
+        numpy.save(filename, table)
+        print("Saved file:", filename)
+        return
+
+    assert '.csv' in filename, 'Error: filename does not contain file type.'
+    with open(filename, 'w', newline='') as f:
+        csv_writer = writer(f)
+        for j in range(y_lo, y_hi + 1):
+            csv_writer.writerow([costs.get((i, j), inf) for i in range(x_lo, x_hi + 1)])
+
+    print("Saved file:", filename)
 
-        for i in range(x_lo, x_hi + 1):
-            cell = (i, j)
-            if cell not in costs:
-                row.append(inf)
-            else:
-                row.append(costs[cell])
 
-        rows.append(row)
+def save_grid_costs(costs, filename='distance_map.csv'):
+    """ Displays cell costs from an origin point over a grid, as save_level_costs does for levels.
+
+    Args:
+        costs: A float array of costs indexed [i, j] like the grid's cells, inf where unreached.
+        filename: The name of the csv file to be created, written one row at a time, or of a .npy file.
+
+    """
+    if filename.endswith('.npy'):
+        numpy.save(filename, costs.T)
+        print("Saved file:", filename)
+        return
 
     assert '.csv' in filename, 'Error: filename does not contain file type.'
     with open(filename, 'w', newline='') as f:
         csv_writer = writer(f)
-        for row in rows:
-            csv_writer.writerow(row)
+        for j in range(costs.shape[1]):
+            csv_writer.writerow(costs[:, j].tolist())
 
-    print("Saved file:", filename)
\ No newline at end of file
+    print("Saved file:", filename)
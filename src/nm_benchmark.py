@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import pickle
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from math import inf
+
+import numpy
+from matplotlib.pyplot import imread
+
+import nm_meshbuilder
+import nm_meshformat
+import nm_pathfinder
+from nm_stats import SearchStats
+
+# Reproducible timings over the bundled maps.
+#
+# For every map in input/ (and the maze example of the Dijkstra forward search), the runner times
+# building the mesh at each min_feature_size, loading the mesh in both formats, seeded random
+# batches of find_path (both with astar and bidirectional) and grid Dijkstra queries, and seeded
+# small edits patched in by update_mesh, whose boxes removed per edit must stay local to the edit.
+# Timings are in milliseconds and memory in MB of peak Python allocations (tracemalloc), measured
+# in separate passes so tracing never slows a timing. Results can be saved as a baseline and
+# later runs compared against it.
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+MAZE_DIR = os.path.join(SOURCE_DIR, 'Dijkstra Forward Search')
+MAPS = ['homer.png', 'ucsc_banana_slug.png', 'test_image.png']
+
+# metrics where bigger is worse, compared against the baseline; the others are only reported
+COMPARED = ('_ms', '_mb', 'expansions', 'removed_per_edit', 'removed_max')
+
+# the largest side of the random edits patched in by bench_update
+EDIT_SIZE = 16
+
+
+def run(input_dir, maze_filename, sizes=(8, 16, 32), queries=200, seed=0, repeat=3):
+    """
+    Runs every benchmark
+
+    Args:
+        input_dir: the directory with the map images and their .mesh.pickle files
+        maze_filename: a maze level text file, or None to skip the grid Dijkstra benchmark
+        sizes: the min_feature_size values to build each map's mesh at
+        queries: the number of queries in each batch, and of edits patched in
+        seed: seeds the query endpoints
+        repeat: everything is timed this many times and the fastest run is kept, query by query
+            for the batches
+
+    Returns:
+        A dict of benchmark name to a dict of metrics
+    """
+    results = {}
+    for name in MAPS:
+        filename = os.path.join(input_dir, name)
+        img = (imread(filename) * 255).astype(dtype=numpy.uint8)
+        if len(img.shape) > 2:
+            img = img[:, :, 0]
+
+        for size in sizes:
+            results['build/%s/%d' % (name, size)] = bench_build(img, size, repeat)
+        results['update/%s' % name] = bench_update(img, sizes[0], queries, seed)
+
+        with open(filename + '.mesh.pickle', 'rb') as f:
+            mesh = pickle.load(f)
+        mesh.pop('search', None)
+        results['load/%s' % name] = bench_load(filename + '.mesh.pickle', repeat)
+        results['find_path/%s' % name] = bench_find_path(mesh, queries, seed, repeat)
+        results['find_path_bidirectional/%s' % name] = bench_find_path(mesh, queries, seed, repeat, bidirectional=True)
+
+    if maze_filename is not None:
+        results['maze/%s' % os.path.basename(maze_filename)] = bench_maze(maze_filename, queries, seed, repeat)
+
+    return results
+
+
+def bench_build(img, min_feature_size, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        mesh = nm_meshbuilder.build_mesh(img, min_feature_size)
+        times.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    nm_meshbuilder.build_mesh(img, min_feature_size)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    boxes, edges = nm_meshbuilder.mesh_counts(mesh)
+    return {'build_ms': min(times) * 1000, 'peak_mb': peak / 2 ** 20, 'boxes': boxes, 'edges': edges}
+
+
+def bench_update(img, min_feature_size, edits, seed):
+    """
+    Times update_mesh on seeded random edits of at most EDIT_SIZE pixels a side, each filling its
+    rectangle with free or blocked pixels, and counts the boxes each removes from the mesh
+    """
+    img = img.copy()
+    mesh = nm_meshbuilder.build_mesh(img, min_feature_size)
+    nm_pathfinder.index_mesh(mesh)
+    rnd = random.Random(seed)
+
+    latencies = []
+    removed_counts = []
+    for _ in range(edits):
+        x = rnd.randrange(img.shape[0])
+        y = rnd.randrange(img.shape[1])
+        rect = (x, x + rnd.randint(1, EDIT_SIZE), y, y + rnd.randint(1, EDIT_SIZE))
+        img[rect[0]:rect[1], rect[2]:rect[3]] = rnd.choice((0, 255))
+        started = time.perf_counter()
+        added, removed = nm_meshbuilder.update_mesh(mesh, img, rect, min_feature_size)
+        latencies.append(time.perf_counter() - started)
+        removed_counts.append(len(removed))
+
+    result = _latency_summary(latencies)
+    result.update({'removed_per_edit': sum(removed_counts) / edits, 'removed_max': max(removed_counts),
+                   'boxes': len(mesh['boxes'])})
+    return result
+
+
+def bench_load(pickle_filename, repeat):
+    """Times loading a mesh until it is ready to search, from the pickle and from a converted array file."""
+    result = {}
+    with tempfile.TemporaryDirectory() as directory:
+        npy_filename = os.path.join(directory, 'mesh.npy')
+        nm_meshformat.convert(pickle_filename, npy_filename)
+
+        for label, filename in (('pickle', pickle_filename), ('npy', npy_filename)):
+            times = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                mesh = nm_meshformat.load_mesh(filename)
+                nm_pathfinder.index_mesh(mesh)
+                nm_pathfinder.search_state(mesh)
+                times.append(time.perf_counter() - started)
+            result['%s_load_ms' % label] = min(times) * 1000
+            del mesh
+
+    return result
+
+
+def bench_find_path(mesh, queries, seed, repeat, bidirectional=False):
+    rnd = random.Random(seed)
+    pairs = []
+    for _ in range(queries):
+        points = []
+        for _ in range(2):
+            x1, x2, y1, y2 = rnd.choice(mesh['boxes'])
+            points.append((rnd.randint(x1, x2), rnd.randint(y1, y2)))
+        pairs.append(points)
+
+    nm_pathfinder.index_mesh(mesh)
+    nm_pathfinder.search_state(mesh)
+    latencies = [inf] * queries
+    for _ in range(repeat):
+        for i, (source_point, destination_point) in enumerate(pairs):
+            started = time.perf_counter()
+            nm_pathfinder.find_path(source_point, destination_point, mesh, bidirectional=bidirectional)
+            latencies[i] = min(latencies[i], time.perf_counter() - started)
+
+    stats = SearchStats()
+    tracemalloc.start()
+    for source_point, destination_point in pairs:
+        nm_pathfinder.find_path(source_point, destination_point, mesh, bidirectional=bidirectional, stats=stats)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = _latency_summary(latencies)
+    info = stats.info()
+    result.update({'expansions': info['expansions'] / queries, 'found': info['found'], 'peak_mb': peak / 2 ** 20})
+    return result
+
+
+def bench_maze(filename, queries, seed, repeat):
+    """Times loading a maze level both ways and Dijkstra between random cells of it, in both forms."""
+    sys.path.insert(0, MAZE_DIR)
+    import maze_environment
+    import Dijkstra_forward_search as dfs
+
+    result = {}
+    for label, load in (('level', maze_environment.load_level), ('grid', maze_environment.load_grid)):
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            load(filename)
+            times.append(time.perf_counter() - started)
+        result['%s_load_ms' % label] = min(times) * 1000
+
+    level = maze_environment.load_level(filename)
+    grid = maze_environment.load_grid(filename)
+    cells = sorted(level['spaces'])
+    rnd = random.Random(seed)
+    pairs = [(rnd.choice(cells), rnd.choice(cells)) for _ in range(queries)]
+
+    latencies = [inf] * queries
+    for _ in range(repeat):
+        for i, (source, destination) in enumerate(pairs):
+            started = time.perf_counter()
+            dfs.dijkstras_shortest_path_grid(source, destination, grid)
+            latencies[i] = min(latencies[i], time.perf_counter() - started)
+    result.update(_latency_summary(latencies))
+
+    # expansions are counted on the level form, which finds the same paths
+    stats = SearchStats()
+    tracemalloc.start()
+    for source, destination in pairs:
+        dfs.dijkstras_shortest_path(source, destination, level, dfs.navigation_edges, stats=stats)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    info = stats.info()
+    result.update({'expansions': info['expansions'] / queries, 'found': info['found'], 'peak_mb': peak / 2 ** 20})
+    return result
+
+
+def _latency_summary(latencies):
+    milliseconds = numpy.array(latencies) * 1000
+    return {'p50_ms': float(numpy.percentile(milliseconds, 50)), 'p99_ms': float(numpy.percentile(milliseconds, 99)),
+            'total_ms': float(milliseconds.sum())}
+
+
+def compare(results, baseline, tolerance=0.25, floor=0.05):
+    """
+    Finds metrics that got worse than the baseline by more than tolerance (a fraction of the
+    baseline value) and by more than floor (in the metric's own unit, to ignore timer noise)
+
+    Returns:
+        (benchmark, metric, baseline value, new value) for every regression
+    """
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            old = baseline.get(name, {}).get(metric)
+            if old is None or not metric.endswith(COMPARED):
+                continue
+            if value > old * (1 + tolerance) and value - old > floor:
+                regressions.append((name, metric, old, value))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    for name, metrics in sorted(results.items()):
+        cells = []
+        for metric, value in sorted(metrics.items()):
+            cell = '%s=%.3g' % (metric, value)
+            old = (baseline or {}).get(name, {}).get(metric)
+            if old:
+                cell += ' (%+.0f%%)' % ((value - old) / old * 100)
+            cells.append(cell)
+        print('%-34s %s' % (name, '  '.join(cells)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Times mesh building, loading and path queries on the bundled maps.')
+    parser.add_argument('--input', default=os.path.join(SOURCE_DIR, '..', 'input'),
+                        help='directory with the map images and their .mesh.pickle files')
+    parser.add_argument('--maze', default=os.path.join(MAZE_DIR, 'example.txt'), help='maze level for grid Dijkstra')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[8, 16, 32], help='min_feature_size values to build at')
+    parser.add_argument('--queries', type=int, default=200, help='queries per batch')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per timing; the fastest is kept')
+    parser.add_argument('--save', help='write the results to this JSON file, to serve as a baseline')
+    parser.add_argument('--compare', help='baseline JSON file to compare against; exits with 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='how much worse than the baseline a metric may get, as a fraction')
+    args = parser.parse_args()
+
+    results = run(args.input, args.maze, args.sizes, args.queries, args.seed, args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'numpy': numpy.__version__, 'machine': platform.machine(),
+                       'seed': args.seed, 'queries': args.queries, 'results': results}, f, indent=1, sort_keys=True)
+        print("Saved file:", args.save)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, old, value in regressions:
+            print("Regression: %s %s went from %.3g to %.3g" % (name, metric, old, value))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against %s." % args.compare)
@@ -0,0 +1,112 @@
+import json
+import socket
+import struct
+
+# Client side of the path query protocol (see nm_service).
+#
+# Every message either way is a 4-byte big-endian length followed by that many bytes of UTF-8 JSON.
+# A query is {"id", "source", "destination"} plus optionally "mesh" (the name the service loaded it
+# under; needed when it serves several), "bidirectional", "heuristic", "weight" and "smooth" as for
+# nm_pathfinder.find_path. The answer carries the same "id" and either "path" (a list of [x, y]
+# points, empty if there is none) and "explored" (the number of boxes expanded), or "error".
+# Queries may be pipelined on one connection; answers can come back in any order.
+
+HEADER = struct.Struct('>I')
+MAX_MESSAGE = 1 << 24
+
+
+def encode_message(message):
+    body = json.dumps(message, separators=(',', ':')).encode()
+    return HEADER.pack(len(body)) + body
+
+
+def parse_address(address):
+    """
+    Reads a service address: 'unix:PATH' or a path containing '/' for a Unix socket, or
+    'HOST:PORT' or 'PORT' for localhost TCP
+
+    Returns:
+        A Unix socket path (str), or a (host, port) tuple
+    """
+    if address.startswith('unix:'):
+        return address[len('unix:'):]
+    if '/' in address:
+        return address
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class PathClient:
+    """
+    A blocking connection to an nm_service
+
+    Args:
+        address: see parse_address
+        timeout: seconds to wait on the socket, or None to wait forever
+    """
+
+    def __init__(self, address, timeout=None):
+        address = parse_address(address)
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile('rb')
+        self.next_id = 0
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def find_path(self, source_point, destination_point, mesh=None, **options):
+        """Asks for one path, as nm_pathfinder.find_path returns it minus the explored boxes."""
+        return self.find_paths([(source_point, destination_point)], mesh, **options)[0]
+
+    def find_paths(self, pairs, mesh=None, **options):
+        """
+        Sends a query per (source_point, destination_point) pair at once, then collects the answers
+
+        Returns:
+            A path (list of point tuples) per pair, in the order of pairs
+
+        Raises:
+            RuntimeError: the service answered a query with an error
+        """
+        ids = []
+        out = []
+        for source_point, destination_point in pairs:
+            query = {'id': self.next_id, 'source': list(source_point), 'destination': list(destination_point)}
+            if mesh is not None:
+                query['mesh'] = mesh
+            query.update(options)
+            ids.append(self.next_id)
+            self.next_id += 1
+            out.append(encode_message(query))
+        self.sock.sendall(b''.join(out))
+
+        answers = {}
+        while len(answers) < len(ids):
+            answer = self.receive()
+            answers[answer['id']] = answer
+
+        paths = []
+        for i in ids:
+            if 'error' in answers[i]:
+                raise RuntimeError(answers[i]['error'])
+            paths.append([tuple(point) for point in answers[i]['path']])
+        return paths
+
+    def receive(self):
+        header = self.file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ConnectionError('the service closed the connection')
+        size, = HEADER.unpack(header)
+        return json.loads(self.file.read(size))
@@ -0,0 +1,177 @@
+import logging
+import sys
+from csv import writer
+from heapq import heappop, heappush
+from math import inf
+
+import numpy
+
+import nm_pathfinder
+from nm_pathfinder import euclidean_distance
+
+logger = logging.getLogger(__name__)
+
+# One-to-many queries toward a single destination.
+#
+# A single Dijkstra runs outward from the destination, with the same cost model find_path uses:
+# a path enters each box where the point it leaves the next one at clamps onto their portal. Every box then knows
+# its distance to the destination, the box to head into next, and the point to head for, so any
+# number of agents can follow the field to the destination without searching.
+
+
+def flow_field(destination_point, mesh):
+    """
+    Computes the distance and next box toward destination_point for every box of the mesh
+
+    Args:
+        destination_point: the point every route leads to
+        mesh: a loaded mesh of either format (see nm_pathfinder.mesh_accessors)
+
+    Returns:
+        A dict indexed by box position in mesh['boxes']: 'distances' (inf where the destination
+        cannot be reached), 'next' (the position of the next box, -1 at the goal box and where
+        there is no way), and 'points' (where the route crosses into the next box), plus the
+        mesh['version'] it was computed for. None if the destination is outside the mesh.
+    """
+    if 'index' not in mesh:
+        nm_pathfinder.index_mesh(mesh)
+    goal = nm_pathfinder.locate_box(mesh['index'], destination_point)
+    if goal is None:
+        logger.info('No flow field: %s is outside the mesh', destination_point)
+        return None
+
+    state = nm_pathfinder.search_state(mesh)
+    boxes, adjacency, portals = state['boxes'], state['adj'], state['portals']
+    distances = [inf] * len(boxes)
+    following = [-1] * len(boxes)
+    points = [None] * len(boxes)
+
+    distances[goal] = 0
+    points[goal] = destination_point
+    queue = [(0, goal)]
+    while queue:
+        cost, cell = heappop(queue)
+        if cost > distances[cell]:
+            continue
+        point = points[cell]
+
+        for child, box in zip(adjacency[cell], portals[cell]):
+            dx, dy = point
+
+            if dx <= box[0]: dx = box[0]
+            if dx >= box[1]: dx = box[1]
+            if dy <= box[2]: dy = box[2]
+            if dy >= box[3]: dy = box[3]
+
+            cost_to_child = cost + euclidean_distance(point, (dx, dy))
+            if cost_to_child < distances[child]:
+                distances[child] = cost_to_child
+                following[child] = cell
+                points[child] = (dx, dy)
+                heappush(queue, (cost_to_child, child))
+
+    return {'destination': destination_point, 'goal': goal,
+            'distances': numpy.array(distances), 'next': numpy.array(following, dtype=numpy.int32),
+            'points': points, 'version': mesh.get('version', 0)}
+
+
+def follow(field, source_point, mesh):
+    """
+    Reads the route from source_point out of a flow field, in time proportional to its length
+
+    Returns:
+        A path (list of points) from source_point to the field's destination if exists
+        The corridor of boxes the path passes through, as find_path lists explored boxes
+    """
+    _check_version(field, mesh)
+    if 'index' not in mesh:
+        nm_pathfinder.index_mesh(mesh)
+    cell = nm_pathfinder.locate_box(mesh['index'], source_point)
+    if cell is None or field['distances'][cell] == inf:
+        logger.info('No path from %s to %s.', source_point, field['destination'])
+        return [], []
+
+    following, points = field['next'], field['points']
+    corridor = [cell]
+    path = [source_point]
+    while cell != field['goal']:
+        path.append(points[cell])
+        cell = int(following[cell])
+        corridor.append(cell)
+    path.append(field['destination'])
+
+    box_of, _ = nm_pathfinder.mesh_accessors(mesh)
+    return path, [box_of(node) for node in corridor]
+
+
+def _check_version(field, mesh):
+    # box positions change when nm_meshbuilder.update_mesh edits the mesh
+    if field['version'] != mesh.get('version', 0):
+        raise ValueError('the mesh was edited after its flow field was computed; run flow_field again')
+
+
+def distance_raster(field, mesh, shape=None):
+    """
+    Spreads a flow field over pixels: each free pixel gets the straight-line distance to the point
+    its box is left through, plus that point's distance to the destination
+
+    Args:
+        shape: (rows, columns) of the raster; by default just large enough to hold every box
+
+    Returns:
+        A float array with inf at pixels no box covers or whose box cannot reach the destination
+    """
+    _check_version(field, mesh)
+    boxes = numpy.asarray(mesh['boxes']).reshape(-1, 4)
+    if shape is None:
+        shape = (int(boxes[:, 1].max()), int(boxes[:, 3].max())) if len(boxes) else (0, 0)
+    raster = numpy.full(shape, inf)
+
+    distances, points = field['distances'], field['points']
+    for position, (x1, x2, y1, y2) in enumerate(boxes.tolist()):
+        if distances[position] == inf:
+            continue
+        px, py = points[position]
+        xs = numpy.arange(x1, x2)[:, None] - px
+        ys = numpy.arange(y1, y2)[None, :] - py
+        region = raster[x1:x2, y1:y2]
+        # overlapping boxes: keep the shorter way
+        numpy.minimum(region, distances[position] + numpy.sqrt(xs * xs + ys * ys), out=region)
+
+    return raster
+
+
+def save_distance_raster(field, mesh, filename='distance_map.csv', shape=None):
+    """
+    Writes distance_raster(field, mesh, shape) to a .csv file, one image row per line, or to a .npy file
+    """
+    raster = distance_raster(field, mesh, shape)
+
+    if filename.endswith('.npy'):
+        numpy.save(filename, raster)
+    else:
+        assert '.csv' in filename, 'Error: filename does not contain file type.'
+        with open(filename, 'w', newline='') as f:
+            csv_writer = writer(f)
+            for row in raster.tolist():
+                csv_writer.writerow(row)
+
+    print("Saved file:", filename)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 5:
+        print("usage: %s map.mesh.pickle|map.mesh.npy x y distance_map.csv|distance_map.npy" % sys.argv[0])
+        sys.exit(-1)
+
+    import nm_meshformat
+
+    _, mesh_filename, x, y, out_filename = sys.argv
+    mesh = nm_meshformat.load_mesh(mesh_filename)
+
+    field = flow_field((int(x), int(y)), mesh)
+    if field is None:
+        sys.exit(-1)
+
+    save_distance_raster(field, mesh, out_filename)
@@ -0,0 +1,200 @@
+import logging
+import pickle
+import sys
+from heapq import heappop, heappush
+from math import inf
+
+import nm_pathfinder
+from nm_pathfinder import euclidean_distance
+
+logger = logging.getLogger(__name__)
+
+# Hierarchical (HPA*-style) search over a box mesh.
+#
+# Boxes are grouped into square clusters by the position of their centers. Boxes with a neighbor
+# in another cluster are the cluster's entrances, and the abstract graph links entrances of the same
+# cluster by their precomputed distance inside it, and entrances of neighboring clusters directly.
+# A query searches that small graph first, then refines the route with a regular A* that may only
+# enter the clusters the abstract route passes through.
+
+
+def build_hierarchy(mesh, cluster_size=128):
+    """
+    Precomputes the abstract graph for hierarchical queries
+
+    Args:
+        mesh: a loaded mesh of either format (see nm_pathfinder.mesh_accessors)
+        cluster_size: side length in pixels of the square cells boxes are clustered by
+
+    Returns:
+        The hierarchy, to be stored as mesh['hierarchy']; distances are measured between box centers
+    """
+    box_of, neighbors = nm_pathfinder.mesh_accessors(mesh)
+    nodes = range(len(mesh['boxes']))
+
+    cluster_of = {}
+    members = {}
+    for node in nodes:
+        x1, x2, y1, y2 = box_of(node)
+        cluster = (int((x1 + x2) / 2 // cluster_size), int((y1 + y2) / 2 // cluster_size))
+        cluster_of[node] = cluster
+        members.setdefault(cluster, []).append(node)
+
+    graph = {}
+    for cluster, nodes_in_cluster in members.items():
+
+        entrances = [n for n in nodes_in_cluster if any(cluster_of[c] != cluster for c in neighbors(n))]
+
+        for entrance in entrances:
+            edges = graph.setdefault(entrance, [])
+
+            # entrances of this cluster reachable without leaving it
+            distances = _cluster_distances(entrance, cluster, cluster_of, box_of, neighbors)
+            edges.extend((other, distances[other]) for other in entrances if other != entrance and other in distances)
+
+            # entrances of the neighboring clusters
+            center = box_center(box_of(entrance))
+            edges.extend((child, euclidean_distance(center, box_center(box_of(child))))
+                         for child in neighbors(entrance) if cluster_of[child] != cluster)
+
+    return {'cluster_size': cluster_size, 'cluster_of': cluster_of, 'graph': graph, 'version': mesh.get('version', 0)}
+
+
+def find_path(source_point, destination_point, mesh):
+    """
+    Searches for a path like nm_pathfinder.find_path, but through the abstract graph first
+
+    Needs mesh['hierarchy'] from build_hierarchy. The abstract route picks the clusters worth
+    searching, and the final A* only expands boxes inside them, so the cost of a query grows with
+    the number of clusters on the route rather than the number of boxes in the mesh.
+
+    Returns:
+        A path (list of points) from source_point to destination_point if exists
+        A list of boxes explored by the algorithm
+    """
+    hierarchy = mesh['hierarchy']
+    cluster_of = hierarchy['cluster_of']
+    if hierarchy['version'] != mesh.get('version', 0):
+        raise ValueError('the mesh was edited after its hierarchy was built; run build_hierarchy again')
+
+    if 'index' not in mesh:
+        nm_pathfinder.index_mesh(mesh)
+    state = nm_pathfinder.search_state(mesh)
+    box_of, neighbors = nm_pathfinder.mesh_accessors(mesh)
+
+    start = nm_pathfinder.locate_box(mesh['index'], source_point)
+    goal = nm_pathfinder.locate_box(mesh['index'], destination_point)
+    if start is None or goal is None:
+        return nm_pathfinder.search(source_point, destination_point, start, goal, state)
+
+    route = abstract_route(start, goal, hierarchy, box_of, neighbors)
+    if route is None:
+        logger.info('No path from %s to %s.', source_point, destination_point)
+        return [], []
+
+    allowed = {cluster_of[node] for node in route}
+
+    def allow(node):
+        return cluster_of[node] in allowed
+
+    return nm_pathfinder.search(source_point, destination_point, start, goal, state, allow)
+
+
+def abstract_route(start, goal, hierarchy, box_of, neighbors):
+    """
+    Finds the sequence of entrance boxes from start to goal through the abstract graph
+
+    start and goal are linked into the graph through the entrances of their own clusters. Their
+    clusters' boxes are the only ones searched box by box.
+
+    Returns:
+        The boxes of the abstract route from start to goal, or None if goal cannot be reached
+    """
+    cluster_of = hierarchy['cluster_of']
+    graph = hierarchy['graph']
+
+    from_start = _cluster_distances(start, cluster_of[start], cluster_of, box_of, neighbors)
+    to_goal = _cluster_distances(goal, cluster_of[goal], cluster_of, box_of, neighbors)
+
+    def edges(node):
+        found = list(graph.get(node, ()))
+        if node == start:
+            found.extend((n, d) for n, d in from_start.items() if n in graph and n != start)
+        if node in to_goal:
+            found.append((goal, to_goal[node]))
+        return found
+
+    goal_center = box_center(box_of(goal))
+    previous = {start: None}
+    costs = {start: 0}
+    queue = [(0, 0, start)]
+    closed = set()
+
+    while queue:
+        _, cost, node = heappop(queue)
+        if node in closed:
+            continue
+        closed.add(node)
+
+        if node == goal:
+            route = []
+            while node is not None:
+                route.append(node)
+                node = previous[node]
+            route.reverse()
+            return route
+
+        for child, step in edges(node):
+            cost_to_child = cost + step
+            if child not in closed and cost_to_child < costs.get(child, inf):
+                costs[child] = cost_to_child
+                previous[child] = node
+                heappush(queue, (cost_to_child + euclidean_distance(box_center(box_of(child)), goal_center),
+                                 cost_to_child, child))
+
+    return None
+
+
+def _cluster_distances(source, cluster, cluster_of, box_of, neighbors):
+    # Dijkstra between box centers, restricted to one cluster
+    distances = {source: 0}
+    queue = [(0, source)]
+    while queue:
+        cost, node = heappop(queue)
+        if cost > distances[node]:
+            continue
+        center = box_center(box_of(node))
+        for child in neighbors(node):
+            if cluster_of[child] != cluster:
+                continue
+            cost_to_child = cost + euclidean_distance(center, box_center(box_of(child)))
+            if cost_to_child < distances.get(child, inf):
+                distances[child] = cost_to_child
+                heappush(queue, (cost_to_child, child))
+    return distances
+
+
+def box_center(box):
+    return (box[0] + box[1]) / 2, (box[2] + box[3]) / 2
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in (2, 3):
+        print("usage: %s map.mesh.pickle [cluster_size]" % sys.argv[0])
+        sys.exit(-1)
+
+    filename = sys.argv[1]
+    cluster_size = int(sys.argv[2]) if len(sys.argv) == 3 else 128
+
+    with open(filename, 'rb') as f:
+        mesh = pickle.load(f)
+
+    mesh['hierarchy'] = build_hierarchy(mesh, cluster_size)
+    del mesh['search']
+
+    with open(filename, 'wb') as f:
+        pickle.dump(mesh, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    clusters = len(set(mesh['hierarchy']['cluster_of'].values()))
+    print("Added a hierarchy of %d clusters and %d entrances." % (clusters, len(mesh['hierarchy']['graph'])))
@@ -1,20 +1,27 @@
 import sys
-import random
-import pickle
+import base64
+import queue
+import struct
+import threading
 import traceback
 import tkinter
+import zlib
 
+import numpy
+
+import nm_meshformat
 import nm_pathfinder
 
 if len(sys.argv) != 4:
-    print("usage: %s map.gif map.mesh.pickle subsample_factor" % sys.argv[0])
+    print("usage: %s map.gif map.mesh.pickle|map.mesh.npy subsample_factor" % sys.argv[0])
     sys.exit(-1)
 
 _, MAP_FILENAME, MESH_FILENAME, SUBSAMPLE = sys.argv
 SUBSAMPLE = int(SUBSAMPLE)
 
-with open(MESH_FILENAME, 'rb') as f:
-  mesh = pickle.load(f)
+mesh = nm_meshformat.load_mesh(MESH_FILENAME)
+nm_pathfinder.index_mesh(mesh)
+nm_pathfinder.search_state(mesh)
 
 master = tkinter.Tk()
 
@@ -25,69 +32,152 @@ SMALL_WIDTH, SMALL_HEIGHT = small_image.width(), small_image.height()
 
 canvas = tkinter.Canvas(master, width=SMALL_WIDTH, height=SMALL_HEIGHT)
 canvas.pack()
+canvas.create_image((0,0), anchor=tkinter.NW, image=small_image)
+
+VISITED_COLOR = (255, 192, 203, 255)  # pink
+POLL_MS = 15
+
+# Queries run on a worker thread, which also rasterizes the visited boxes into one PNG overlay;
+# the Tk thread only polls for finished results and swaps the few canvas items that changed.
+# Every query carries a number, and results of queries cleared by a later click are dropped.
 
 
 def shrink(values):
-    #for v in values:
-        #print(f'debug, here is v: {v}')
     return [v/SUBSAMPLE for v in values]
 
+
+def visited_overlay(boxes):
+    """Draws the outlines of boxes onto a transparent image the size of the canvas, as PNG bytes."""
+    rgba = numpy.zeros((SMALL_HEIGHT, SMALL_WIDTH, 4), dtype=numpy.uint8)
+    bottom, right = SMALL_HEIGHT - 1, SMALL_WIDTH - 1
+    for box in boxes:
+        x1, x2, y1, y2 = (int(v) for v in shrink(box))
+        x2, y2 = min(x2, bottom), min(y2, right)
+        rgba[x1, y1:y2 + 1] = VISITED_COLOR
+        rgba[x2, y1:y2 + 1] = VISITED_COLOR
+        rgba[x1:x2 + 1, y1] = VISITED_COLOR
+        rgba[x1:x2 + 1, y2] = VISITED_COLOR
+    return png_bytes(rgba)
+
+
+def png_bytes(rgba):
+    """Encodes an RGBA uint8 array as a PNG, which PhotoImage reads with its transparency."""
+    height, width, _ = rgba.shape
+    rows = numpy.zeros((height, 1 + 4 * width), dtype=numpy.uint8)  # filter type 0 before every row
+    rows[:, 1:] = rgba.reshape(height, -1)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows.tobytes(), 1))
+            + chunk(b'IEND', b''))
+
+
+def search_worker():
+    while True:
+        number, source, destination = requests.get()
+        try:
+            found, visited = nm_pathfinder.find_path(source, destination, mesh)
+            results.put((number, found, visited_overlay(visited) if visited else None))
+        except Exception:
+            results.put((number, None, traceback.format_exc()))
+
+
+requests = queue.Queue()
+results = queue.Queue()
+threading.Thread(target=search_worker, daemon=True).start()
+
 source_point = None
 destination_point = None
-visited_boxes = []
-path = []
+query_number = 0
+pending = 0         # queries handed to the worker whose results have not been polled yet
+items = {}          # canvas item of each overlay: 'visited', 'path', 'source', 'destination'
+overlay_image = None
+
+
+def remove(name):
+    if name in items:
+        canvas.delete(items.pop(name))
+
+
+def mark(name, point):
+    remove(name)
+    x,y = shrink(point)
+    items[name] = canvas.create_oval(y-5,x-5,y+5,x+5,width=2,outline='red')
+
 
+def poll():
 
-def redraw():
+    global pending
 
-    canvas.delete(tkinter.ALL)
-    canvas.create_image((0,0), anchor=tkinter.NW, image=small_image)
+    while True:
+        try:
+            number, found, overlay = results.get_nowait()
+        except queue.Empty:
+            break
+        pending -= 1
+        if number == query_number:
+            show(found, overlay)
+
+    if pending:
+        master.after(POLL_MS, poll)
 
-    for box in visited_boxes:
-        #print(f'debug, here is a box: {box}')
-        x1,x2,y1,y2 = shrink(box)
-        canvas.create_rectangle(y1,x1,y2,x2,outline='pink')
 
-    for i in range(len(path) - 1):
-        x1, y1 = shrink(path[i])
-        x2, y2 = shrink(path[i + 1])
-        #print(f'x1: {x1}, x2: {x2}, y1: {y1}, y2: {y2}')
-        canvas.create_line(y1,x1,y2,x2,width=2.0,fill='red')
+def show(found, overlay):
 
-    if source_point:
-        x,y = shrink(source_point)
-        canvas.create_oval(y-5,x-5,y+5,x+5,width=2,outline='red')
+    global destination_point, overlay_image
 
-    if destination_point:
-        x,y = shrink(destination_point)
-        canvas.create_oval(y-5,x-5,y+5,x+5,width=2,outline='red')
+    canvas.config(cursor='')
+    remove('visited')
+    remove('path')
+    if found is None:
+        destination_point = None
+        remove('destination')
+        print(overlay, file=sys.stderr)
+        return
+
+    if overlay is not None:
+        overlay_image = tkinter.PhotoImage(data=base64.b64encode(overlay))
+        items['visited'] = canvas.create_image((0,0), anchor=tkinter.NW, image=overlay_image)
+    if len(found) > 1:
+        coordinates = []
+        for point in found:
+            x, y = shrink(point)
+            coordinates.extend((y, x))
+        items['path'] = canvas.create_line(*coordinates, width=2.0, fill='red')
+    for name in ('source', 'destination'):
+        canvas.tag_raise(items[name])
 
 
 def on_click(event):
 
-    global source_point, destination_point, visited_boxes, path
+    global source_point, destination_point, query_number, pending, overlay_image
 
     if source_point and destination_point:
         source_point = None
         destination_point = None
-        visited_boxes = []
-        path = []
+        query_number += 1
+        for name in list(items):
+            remove(name)
+        overlay_image = None
+        canvas.config(cursor='')
 
     elif not source_point:
         source_point = event.y*SUBSAMPLE, event.x*SUBSAMPLE
+        mark('source', source_point)
 
     else:
         destination_point = event.y*SUBSAMPLE, event.x*SUBSAMPLE
-        try:
-            path, visited_boxes = nm_pathfinder.find_path(source_point, destination_point, mesh)
-
-        except:
-            destination_point = None
-            traceback.print_exc()
-
-    redraw()
+        mark('destination', destination_point)
+        query_number += 1
+        requests.put((query_number, source_point, destination_point))
+        canvas.config(cursor='watch')
+        pending += 1
+        if pending == 1:
+            master.after(POLL_MS, poll)
 
 canvas.bind('<Button-1>', on_click)
 
-redraw()
 master.mainloop()
@@ -0,0 +1,194 @@
+import pickle
+import sys
+from heapq import heappop, heappush
+from math import inf
+
+import numpy
+
+import nm_pathfinder
+from nm_hierarchy import box_center
+from nm_pathfinder import euclidean_distance
+
+# ALT (A*, landmarks, triangle inequality) heuristic for the box mesh.
+#
+# A handful of landmark boxes are picked far apart from each other, and the distance from every
+# landmark to every box is computed once. For any landmark L, |d(L, goal) - d(L, box)| cannot be
+# more than the distance from the box to the goal, and the largest of those bounds is usually far
+# closer to the true remaining distance than the straight line, most of all around walls.
+#
+# Distances run between box centers, like nm_hierarchy's, so they approximate rather than bound
+# the entry-point path lengths A* measures; the estimate never drops below the straight line.
+# Pickled meshes keep the tables in mesh['landmarks']; array meshes in their 'landmark_nodes' and
+# 'landmark_distances' sections (see nm_meshformat).
+
+
+def build_landmarks(mesh, count=8):
+    """
+    Picks landmarks and computes their distance tables
+
+    The first landmark is the box farthest from an arbitrary box of the largest connected part of
+    the mesh, and each next one the box farthest from all landmarks picked so far.
+
+    Args:
+        mesh: a loaded mesh of either format (see nm_pathfinder.mesh_accessors)
+        count: the number of landmarks
+
+    Returns:
+        The landmark box positions, and a float32 array with the distance from landmark j to box i
+        in row i, column j; boxes a landmark cannot reach are at inf
+    """
+    state = nm_pathfinder.search_state(mesh)
+    boxes, adjacency = state['boxes'], state['adj']
+    centers = [box_center(box) for box in boxes]
+
+    if not centers:
+        return [], numpy.zeros((0, 0), dtype=numpy.float32)
+
+    component = _largest_component(adjacency)
+    seed = distances_from(component[0], adjacency, centers)
+    landmarks = [max(component, key=seed.__getitem__)]
+
+    columns = []
+    nearest = [inf] * len(centers)
+    while True:
+        distances = distances_from(landmarks[-1], adjacency, centers)
+        columns.append(distances)
+        nearest = [min(a, b) for a, b in zip(nearest, distances)]
+        if len(landmarks) == count:
+            break
+        farthest = max(component, key=nearest.__getitem__)
+        if nearest[farthest] == 0:
+            break  # every box of the component already is a landmark
+        landmarks.append(farthest)
+
+    return landmarks, numpy.array(columns, dtype=numpy.float32).T
+
+
+def add_landmarks(mesh, count=8):
+    """
+    Builds landmark tables (see build_landmarks) and stores them in the mesh
+
+    For a pickled mesh, mesh['landmarks'] lists the tuple of landmark distances of each box by
+    box ID; the tables carry the mesh version and must be rebuilt after nm_meshbuilder.update_mesh.
+    """
+    landmarks, table = build_landmarks(mesh, count)
+    if 'adj_offsets' in mesh:
+        mesh['landmark_nodes'] = numpy.array(landmarks, dtype=numpy.int32)
+        mesh['landmark_distances'] = table
+    else:
+        boxes = mesh['boxes']
+        mesh['landmarks'] = {'nodes': [boxes[i] for i in landmarks],
+                             'distances': [tuple(row) for row in table.tolist()],
+                             'version': mesh.get('version', 0)}
+    return landmarks
+
+
+class LandmarkHeuristic:
+    """
+    The ALT heuristic over a mesh's landmark tables, for nm_pathfinder.find_path
+
+    find_path(..., heuristic='landmarks') creates one; build it once and pass it instead to
+    reuse it across queries.
+    """
+
+    def __init__(self, mesh):
+        if 'landmark_distances' in mesh:
+            self.rows = mesh['landmark_distances']
+            self.array_mesh = True
+        elif 'landmarks' in mesh:
+            if mesh['landmarks']['version'] != mesh.get('version', 0):
+                raise ValueError('the mesh was edited after its landmarks were built; run add_landmarks again')
+            self.rows = mesh['landmarks']['distances']
+            self.array_mesh = False
+        else:
+            raise ValueError('the mesh has no landmark tables; run nm_landmarks.py on it first')
+
+    def bind(self, target_point, target_node):
+        rows = self.rows
+        target = rows[target_node]
+
+        if self.array_mesh:
+            target = numpy.asarray(target, dtype=numpy.float64)
+
+            if not numpy.isfinite(target).all():
+                # the landmarks all lie in one connected part of the mesh, and the target is outside
+                # it: only boxes outside it too can still lead there
+                def estimate(point, node):
+                    return inf if numpy.isfinite(rows[node][0]) else euclidean_distance(point, target_point)
+                return estimate
+
+            def estimate(point, node):
+                straight = euclidean_distance(point, target_point)
+                bound = numpy.abs(target - rows[node]).max()
+                return bound if bound > straight else straight
+            return estimate
+
+        def estimate(point, node):
+            best = euclidean_distance(point, target_point)
+            for a, b in zip(target, rows[node]):
+                bound = abs(a - b)
+                if bound > best:  # nan when neither box is connected to the landmarks
+                    best = bound
+            return best
+        return estimate
+
+
+def distances_from(source, adjacency, centers):
+    """Dijkstra between box centers from box position source to every box position."""
+    distances = [inf] * len(centers)
+    distances[source] = 0
+    queue = [(0, source)]
+    while queue:
+        cost, node = heappop(queue)
+        if cost > distances[node]:
+            continue
+        center = centers[node]
+        for child in adjacency[node]:
+            cost_to_child = cost + euclidean_distance(center, centers[child])
+            if cost_to_child < distances[child]:
+                distances[child] = cost_to_child
+                heappush(queue, (cost_to_child, child))
+    return distances
+
+
+def _largest_component(adjacency):
+    seen = [False] * len(adjacency)
+    largest = []
+    for root in range(len(adjacency)):
+        if seen[root]:
+            continue
+        seen[root] = True
+        component = [root]
+        for node in component:
+            for child in adjacency[node]:
+                if not seen[child]:
+                    seen[child] = True
+                    component.append(child)
+        if len(component) > len(largest):
+            largest = component
+    return largest
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in (2, 3):
+        print("usage: %s map.mesh.pickle|map.mesh.npy [count]" % sys.argv[0])
+        sys.exit(-1)
+
+    filename = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) == 3 else 8
+
+    if filename.endswith('.npy'):
+        import nm_meshformat
+        mesh = nm_meshformat.load_mesh(filename, mmap=False)
+        landmarks = add_landmarks(mesh, count)
+        nm_meshformat.save_mesh(mesh, filename)
+    else:
+        with open(filename, 'rb') as f:
+            mesh = pickle.load(f)
+        landmarks = add_landmarks(mesh, count)
+        del mesh['search']
+        with open(filename, 'wb') as f:
+            pickle.dump(mesh, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    print("Added %d landmarks over %d boxes." % (len(landmarks), len(mesh['boxes'])))
@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy
+
+import nm_meshformat
+from nm_client import HEADER, encode_message, parse_address
+
+# Measures the throughput and latency of an nm_service.
+#
+# Endpoints are drawn with a seeded generator from the boxes of a local copy of the served mesh.
+# Each connection keeps up to depth queries in flight, so connections x depth queries are pending
+# at once; latency is measured from sending a query to reading its answer.
+
+
+def random_pairs(mesh, count, seed=0):
+    """Picks count (source_point, destination_point) pairs, each point inside a random box of mesh."""
+    rnd = random.Random(seed)
+    boxes = numpy.asarray(mesh['boxes']).reshape(-1, 4).tolist()
+    pairs = []
+    for _ in range(count):
+        points = []
+        for _ in range(2):
+            x1, x2, y1, y2 = rnd.choice(boxes)
+            points.append((rnd.randint(x1, x2), rnd.randint(y1, y2)))
+        pairs.append(tuple(points))
+    return pairs
+
+
+async def run_connection(address, pairs, depth, mesh_name=None, options=None):
+    """Sends every pair over one connection, keeping up to depth queries in flight; returns their latencies."""
+    if isinstance(address, str):
+        reader, writer = await asyncio.open_unix_connection(address)
+    else:
+        reader, writer = await asyncio.open_connection(*address)
+
+    window = asyncio.Semaphore(depth)
+    sent = {}
+    latencies = []
+    errors = 0
+
+    async def send():
+        for i, (source_point, destination_point) in enumerate(pairs):
+            await window.acquire()
+            query = {'id': i, 'source': source_point, 'destination': destination_point}
+            if mesh_name is not None:
+                query['mesh'] = mesh_name
+            query.update(options or {})
+            sent[i] = time.perf_counter()
+            writer.write(encode_message(query))
+            await writer.drain()
+
+    sender = asyncio.ensure_future(send())
+    for _ in pairs:
+        size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+        answer = json.loads(await reader.readexactly(size))
+        latencies.append(time.perf_counter() - sent.pop(answer['id']))
+        errors += 'error' in answer
+        window.release()
+    await sender
+    writer.close()
+    return latencies, errors
+
+
+async def run(address, pairs, connections, depth, mesh_name=None, options=None):
+    address = parse_address(address)
+    shares = [pairs[i::connections] for i in range(connections)]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(run_connection(address, share, depth, mesh_name, options) for share in shares))
+    elapsed = time.perf_counter() - started
+
+    latencies = numpy.array([latency for share, _ in results for latency in share]) * 1000
+    return {'queries': len(latencies), 'errors': sum(errors for _, errors in results), 'seconds': elapsed,
+            'throughput': len(latencies) / elapsed,
+            'p50_ms': float(numpy.percentile(latencies, 50)), 'p99_ms': float(numpy.percentile(latencies, 99))}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Measures the throughput of an nm_service.')
+    parser.add_argument('mesh_filename', help='a local copy of the served mesh, to draw endpoints from')
+    parser.add_argument('--address', default='127.0.0.1:8765')
+    parser.add_argument('--mesh', help='the name the service knows the mesh by, if it serves several')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--depth', type=int, default=16, help='queries in flight per connection')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    pairs = random_pairs(nm_meshformat.load_mesh(args.mesh_filename), args.queries, args.seed)
+    result = asyncio.run(run(args.address, pairs, args.connections, args.depth, args.mesh))
+
+    print("%(queries)d queries (%(errors)d errors) in %(seconds).2fs: %(throughput).0f queries/s, "
+          "p50 %(p50_ms).2f ms, p99 %(p99_ms).2f ms" % result)
@@ -1,160 +1,776 @@
+import argparse
 import collections
+import os
 import pickle
-import sys
+import struct
 import random
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from math import sqrt
 
 from matplotlib.pyplot import imread, imsave
 import numpy
 from numpy import zeros_like
 
+import nm_meshcache
+import nm_pathfinder
 
-def build_mesh(image, min_feature_size):
-    def scan(box):
 
+FREE, BLOCKED, MIXED = 'free', 'blocked', 'mixed'
+
+# bump whenever a change alters the meshes build_mesh returns, so cached meshes are rebuilt
+BUILDER_VERSION = 1
+
+# map images built in directory mode
+MAP_EXTENSIONS = ('.png', '.gif', '.jpg', '.jpeg', '.bmp')
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def integral_image(mask):
+    """Summed-area table of a boolean mask, with a leading row and column of zeros."""
+    dtype = numpy.int32 if mask.size < 2 ** 31 else numpy.int64
+    table = numpy.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=dtype)
+    numpy.cumsum(numpy.cumsum(mask, axis=0, dtype=dtype), axis=1, out=table[1:, 1:])
+    return table
+
+
+def box_sum(table, box):
+    """Number of set mask pixels inside box, in O(1) from its integral image."""
+    x1, x2, y1, y2 = box
+    return table.item(x2, y2) - table.item(x1, y2) - table.item(x2, y1) + table.item(x1, y1)
+
+
+def array_classifier(image):
+    """Classifies boxes of an in-memory image as FREE, BLOCKED or MIXED in O(1) each."""
+
+    # count free and blocked pixels once up front so every uniformity test is O(1)
+    free = integral_image(image == 255)
+    blocked = integral_image(image == 0)
+
+    def classify(box):
+        area = (box[1] - box[0]) * (box[3] - box[2])
+        if box_sum(free, box) == area:
+            return FREE
+        if box_sum(blocked, box) == area:
+            return BLOCKED
+        return MIXED
+
+    return classify
+
+
+def tiled_classifier(image, tile_size):
+    """
+    Classifies boxes of an image that may not fit in memory, such as a numpy.memmap
+
+    The first box no bigger than a tile_size x tile_size tile is read into memory along with its
+    integral images, and the boxes the scan later cuts out of it are answered from there. Bigger
+    boxes are checked a strip of rows at a time, stopping as soon as the box is known to be MIXED.
+    """
+    tile_area = tile_size * tile_size
+    tile = {'box': None}
+
+    def classify(box):
         x1, x2, y1, y2 = box
         area = (x2 - x1) * (y2 - y1)
 
-        if area < min_feature_size or (image[x1:x2, y1:y2] == 255).all() or (image[x1:x2, y1:y2] == 0).all():
+        t = tile['box']
+        if t is None or not (t[0] <= x1 and x2 <= t[1] and t[2] <= y1 and y2 <= t[3]):
+            if area > tile_area:
+                return classify_streaming(box)
+            pixels = numpy.asarray(image[x1:x2, y1:y2])
+            tile.update(box=box, free=integral_image(pixels == 255), blocked=integral_image(pixels == 0))
+            t = box
+
+        local = (x1 - t[0], x2 - t[0], y1 - t[2], y2 - t[2])
+        if box_sum(tile['free'], local) == area:
+            return FREE
+        if box_sum(tile['blocked'], local) == area:
+            return BLOCKED
+        return MIXED
+
+    def classify_streaming(box):
+        x1, x2, y1, y2 = box
+        rows = max(1, tile_area // max(1, y2 - y1))
+        all_free = all_blocked = True
+        for r in range(x1, x2, rows):
+            strip = numpy.asarray(image[r:min(r + rows, x2), y1:y2])
+            all_free = all_free and bool((strip == 255).all())
+            all_blocked = all_blocked and bool((strip == 0).all())
+            if not all_free and not all_blocked:
+                return MIXED
+        return FREE if all_free else BLOCKED
+
+    return classify
+
+
+def split_box(box):
+    """Cuts box in half across its longest dimension, returning (first_box, second_box, axis, cut)."""
+    x1, x2, y1, y2 = box
+    if x2 - x1 > y2 - y1:
+        cut = int(x1 + (x2 - x1) / 2 + 1)
+        return (x1, cut, y1, y2), (cut, x2, y1, y2), 0, cut
+    else:
+        cut = int(y1 + (y2 - y1) / 2 + 1)
+        return (x1, x2, y1, cut), (x1, x2, cut, y2), 1, cut
 
-            # this box is simple enough to handle in one node
-            if (image[x1:x2, y1:y2] == 255).all():
-                return [box], []
-            else:
-                return [], []
 
-        else:
+def merge_halves(axis, cut, first, second):
+    """
+    Joins the (boxes, edges) of the two halves of a cut box into the (boxes, edges) of the whole
 
-            # recursively split this big box on the longest dimension
-            if x2 - x1 > y2 - y1:
+    Boxes that meet exactly across the cut are merged into one, and boxes that overlap across it
+    get an edge. Both sides are walked once in rank order, so this is linear in the seam length.
+    """
+    first_boxes, first_edges = first
+    second_boxes, second_edges = second
 
-                cut = int(x1 + (x2 - x1) / 2 + 1)
-                first_box = (x1, cut, y1, y2)
-                second_box = (cut, x2, y1, y2)
+    if axis == 0:
+        lo, hi, first_side, second_side = 2, 3, 1, 0
+    else:
+        lo, hi, first_side, second_side = 0, 1, 3, 2
 
-                def rank(b): return (b[2], b[3])
+    def rank(b): return (b[lo], b[hi])
 
-                def first_touch(b): return b[1] == cut
+    my_boxes = [fb for fb in first_boxes if fb[first_side] != cut]
+    my_boxes.extend([sb for sb in second_boxes if sb[second_side] != cut])
+    my_edges = []
 
-                def second_touch(b): return b[0] == cut
+    first_touches = sorted([fb for fb in first_boxes if fb[first_side] == cut], key=rank)
+    second_touches = sorted([sb for sb in second_boxes if sb[second_side] == cut], key=rank)
 
-            else:
+    first_merges = {}
+    second_merges = {}
 
-                cut = int(y1 + (y2 - y1) / 2 + 1)
-                first_box = (x1, x2, y1, cut)
-                second_box = (x1, x2, cut, y2)
+    i = j = 0
+    while i < len(first_touches) and j < len(second_touches):
 
-                def rank(b): return (b[0], b[1])
+        f, s = first_touches[i], second_touches[j]
+        rf, rs = rank(f), rank(s)
 
-                def first_touch(b): return b[3] == cut
+        if rf == rs:
 
-                def second_touch(b): return b[2] == cut
+            i += 1
+            j += 1
+            merged = (f[0], s[1], f[2], s[3])
+            first_merges[f] = merged
+            second_merges[s] = merged
+            my_boxes.append(merged)
 
-            first_boxes, first_edges = scan(first_box)
-            second_boxes, second_edges = scan(second_box)
+        elif rf[1] < rs[1]:
 
-            my_boxes = []
-            my_edges = []
+            my_boxes.append(f)
+            i += 1
+            if rf[1] >= rs[0]:
+                my_edges.append((f, s))
 
-            my_boxes.extend([fb for fb in first_boxes if not first_touch(fb)])
-            my_boxes.extend(
-                [sb for sb in second_boxes if not second_touch(sb)])
+        elif rf[1] > rs[1]:
 
-            first_touches = sorted(filter(first_touch, first_boxes), key=rank)
-            second_touches = sorted(
-                filter(second_touch, second_boxes), key=rank)
+            my_boxes.append(s)
+            j += 1
+            if rf[0] <= rs[1]:
+                my_edges.append((f, s))
 
-            first_merges = {}
-            second_merges = {}
+        else:
+
+            my_boxes.append(f)
+            my_boxes.append(s)
+            i += 1
+            j += 1
+            my_edges.append((f, s))
 
-            while first_touches and second_touches:
+    my_boxes.extend(first_touches[i:])
+    my_boxes.extend(second_touches[j:])
 
-                f, s = first_touches[0], second_touches[0]
-                rf, rs = rank(f), rank(s)
+    for a, b in first_edges:
+        my_edges.append((first_merges.get(a, a), first_merges.get(b, b)))
 
-                if rf == rs:
+    for a, b in second_edges:
+        my_edges.append((second_merges.get(a, a), second_merges.get(b, b)))
 
-                    first_touches.pop(0)
-                    second_touches.pop(0)
-                    merged = (f[0], s[1], f[2], s[3])
-                    first_merges[f] = merged
-                    second_merges[s] = merged
-                    my_boxes.append(merged)
+    return my_boxes, my_edges
 
-                elif rf[1] < rs[1]:
 
-                    my_boxes.append(first_touches.pop(0))
-                    if rf[1] >= rs[0]:
-                        my_edges.append((f, s))
+def scan_boxes(root, min_feature_size, classify, known=None):
+    """
+    Recursively splits root until every piece is uniform or smaller than min_feature_size
 
-                elif rf[1] > rs[1]:
+    The recursion runs on an explicit work stack: a box is pushed once to be classified and, if it
+    has to be split, once more to merge its halves after both have been scanned.
 
-                    my_boxes.append(second_touches.pop(0))
-                    if rf[0] <= rs[1]:
-                        my_edges.append((f, s))
+    Args:
+        known: (boxes, edges) already scanned for some boxes of the split tree, used as they are
 
-                else:
+    Returns:
+        The free boxes and the edges between them
+    """
+    stack = [(root, None)]
+    results = []
 
-                    my_boxes.append(first_touches.pop(0))
-                    my_boxes.append(second_touches.pop(0))
-                    my_edges.append((f, s))
+    while stack:
+        box, split = stack.pop()
 
-            my_boxes.extend(first_touches)
-            my_boxes.extend(second_touches)
+        if split is not None:
+            second = results.pop()
+            first = results.pop()
+            results.append(merge_halves(split[0], split[1], first, second))
+            continue
 
-            for a, b in first_edges:
-                my_edges.append(
-                    (first_merges.get(a, a), first_merges.get(b, b)))
+        if known and box in known:
+            results.append(known[box])
+            continue
+
+        x1, x2, y1, y2 = box
+        kind = classify(box)
 
-            for a, b in second_edges:
-                my_edges.append(
-                    (second_merges.get(a, a), second_merges.get(b, b)))
+        if (x2 - x1) * (y2 - y1) < min_feature_size or kind != MIXED:
+            # this box is simple enough to handle in one node
+            results.append(([box] if kind == FREE else [], []))
+            continue
 
-            return my_boxes, my_edges
+        # split this big box on the longest dimension and come back to merge the halves
+        first_box, second_box, axis, cut = split_box(box)
+        if box in (first_box, second_box):
+            # no side is longer than 2 pixels, so the cut misses: a mixed leaf, like a box below min_feature_size
+            results.append(([], []))
+            continue
+        stack.append((box, (axis, cut)))
+        stack.append((second_box, None))
+        stack.append((first_box, None))
 
-            # end of scan
+    return results.pop()
 
-    boxes, edges = scan((0, image.shape[0], 0, image.shape[1]))
 
+def mesh_from_edges(edges):
     adj = collections.defaultdict(list)
     for a, b in edges:
         adj[a].append(b)
         adj[b].append(a)
 
-    mesh = {'boxes': list(adj.keys()), 'adj': dict(adj)}
+    return {'boxes': list(adj.keys()), 'adj': dict(adj)}
 
-    return mesh
 
+def merge_boxes(mesh):
+    """
+    Re-cuts the free space of a mesh into fewer, larger rectangles and rebuilds the adjacency
 
-if __name__ == '__main__':
+    The binary split only merges boxes across a cut that match it exactly, so open areas are left
+    as many thin boxes. Here the box edges are laid over the covered area as a coarse grid, and the
+    grid is swept row by row: the first uncovered cell starts a rectangle, which grows along its
+    row as far as the free cells go, then down as long as the whole span stays free. The boxes cover
+    exactly the same pixels as before. Boxes are then adjacent when they touch, as in update_mesh;
+    a box left without neighbors is kept, since it still covers free space.
+
+    Args:
+        mesh: a {'boxes': [...], 'adj': {...}} mesh
+
+    Returns:
+        A new mesh in the same format
+    """
+    merged = merge_rectangles(mesh['boxes'])
 
-    min_feature_size = 16
-    filename = None
+    index = nm_pathfinder.build_box_index(merged)
+    adj = {}
+    for position, box in enumerate(merged):
+        adj[box] = [merged[p] for p in sorted(nm_pathfinder.query_index(index, box)) if p != position]
+
+    return {'boxes': merged, 'adj': adj}
+
+
+def merge_rectangles(boxes):
+    """Re-cuts the area the boxes cover into fewer, larger rectangles, as merge_boxes describes."""
+    if not boxes:
+        return []
+
+    xs = sorted({v for box in boxes for v in box[:2]})
+    ys = sorted({v for box in boxes for v in box[2:]})
+    x_rank = {v: i for i, v in enumerate(xs)}
+    y_rank = {v: i for i, v in enumerate(ys)}
+
+    free = numpy.zeros((len(xs) - 1, len(ys) - 1), dtype=bool)
+    for x1, x2, y1, y2 in boxes:
+        free[x_rank[x1]:x_rank[x2], y_rank[y1]:y_rank[y2]] = True
+
+    merged = []
+    rows, columns = free.shape
+    for i, j in zip(*numpy.nonzero(free)):
+        if not free[i, j]:
+            continue  # covered by a rectangle started on an earlier row
+        j2 = j + 1
+        while j2 < columns and free[i, j2]:
+            j2 += 1
+        i2 = i + 1
+        while i2 < rows and free[i2, j:j2].all():
+            i2 += 1
+        free[i:i2, j:j2] = False
+        merged.append((xs[i], xs[i2], ys[j], ys[j2]))
+    return merged
+
+
+def mesh_counts(mesh):
+    """Returns the number of boxes and of (undirected) adjacencies in a mesh."""
+    return len(mesh['boxes']), sum(len(neighbors) for neighbors in mesh['adj'].values()) // 2
+
+
+def build_mesh(image, min_feature_size):
+    boxes, edges = scan_boxes((0, image.shape[0], 0, image.shape[1]), min_feature_size, array_classifier(image))
+    return mesh_from_edges(edges)
+
+
+def build_mesh_tiled(image, min_feature_size, tile_size=1024):
+    """
+    Builds the same mesh as build_mesh while holding at most one tile of image in memory
+
+    Args:
+        image: a 2D uint8 array, typically numpy.memmap over a raw file (see open_raw and png_to_raw)
+        min_feature_size: boxes with a smaller area are not split any further
+        tile_size: side length of the largest square region read into memory at once
+    """
+    classify = tiled_classifier(image, tile_size)
+    boxes, edges = scan_boxes((0, image.shape[0], 0, image.shape[1]), min_feature_size, classify)
+    return mesh_from_edges(edges)
+
+
+def build_mesh_parallel(image, min_feature_size, jobs, tile_size=1024, split_depth=None):
+    """
+    Builds the same mesh as build_mesh with the lower part of the split tree scanned by jobs processes
+
+    The top split_depth levels of cuts are classified here. Every box at that depth that still needs
+    splitting is scanned by a worker, which maps the image itself (the memmap's file, or a temporary
+    raw copy of an in-memory image), and the sub-meshes are stitched back together along the cuts by
+    the same merge_halves pass that scan_boxes uses.
+
+    Args:
+        split_depth: levels of cuts made before handing out work, by default enough for about
+            four tasks per worker
+    """
+    if split_depth is None:
+        split_depth = max(1, jobs - 1).bit_length() + 2
+
+    root = (0, image.shape[0], 0, image.shape[1])
+    classify = tiled_classifier(image, tile_size)
+    kinds = {}
+
+    def remember(box):
+        if box not in kinds:
+            kinds[box] = classify(box)
+        return kinds[box]
+
+    # walk the top of the split tree to find the boxes worth farming out
+    frontier = []
+    stack = [(root, 0)]
+    while stack:
+        box, depth = stack.pop()
+        x1, x2, y1, y2 = box
+        if (x2 - x1) * (y2 - y1) < min_feature_size or remember(box) != MIXED:
+            continue
+        if depth == split_depth:
+            frontier.append(box)
+            continue
+        first_box, second_box, axis, cut = split_box(box)
+        if box in (first_box, second_box):
+            continue  # too small to cut; scan_boxes leaves it whole
+        stack.append((second_box, depth + 1))
+        stack.append((first_box, depth + 1))
+
+    raw = None
+    if isinstance(image, numpy.memmap) and image.filename and image.offset == 0 \
+            and image.dtype == numpy.uint8 and image.flags.c_contiguous:
+        source = (image.filename, image.shape)
+    else:
+        raw = tempfile.NamedTemporaryFile(suffix='.raw', delete=False)
+        with raw:
+            raw.write(numpy.ascontiguousarray(image, dtype=numpy.uint8).tobytes())
+        source = (raw.name, image.shape)
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {box: pool.submit(_scan_worker, source, box, min_feature_size, tile_size) for box in frontier}
+            known = {box: future.result() for box, future in futures.items()}
+    finally:
+        if raw is not None:
+            os.unlink(raw.name)
+
+    boxes, edges = scan_boxes(root, min_feature_size, remember, known)
+    return mesh_from_edges(edges)
+
+
+def _scan_worker(source, box, min_feature_size, tile_size):
+    image = open_raw(*source)
+    return scan_boxes(box, min_feature_size, tiled_classifier(image, tile_size))
+
+
+def update_mesh(mesh, image, rect, min_feature_size):
+    """
+    Re-meshes only the part of a mesh under pixels of the map that changed
+
+    Every box overlapping the changed rectangle is cut along its edges: the pieces outside it stay
+    free, since none of their pixels changed, and the rectangle itself is rebuilt from image. The
+    pieces, the rebuilt boxes and the boxes next to them are then re-cut together into as few
+    rectangles as merge_boxes would make, so repeated edits don't leave slivers behind, and only
+    boxes this re-cut changes are replaced. mesh['adj'] is patched where the new boxes meet each
+    other and the old boxes around them. Like build_mesh, boxes left without any neighbor are
+    dropped from the mesh. mesh['boxes'] is patched in place (freed positions are reused, so its
+    order changes) and so is mesh['index']. mesh['version'] is bumped so caches built on the old
+    mesh (see nm_pathcache) know to drop their entries; the mesh's search state is patched rather
+    than rebuilt (see nm_pathfinder.patch_search_state).
+
+    Args:
+        mesh: a {'boxes': [...], 'adj': {...}} mesh, updated in place
+        image: the whole map, already edited
+        rect: (x1, x2, y1, y2) pixel range that changed
+        min_feature_size: the value the mesh was built with
+
+    Returns:
+        The boxes added to the mesh and the boxes removed from it; in this mesh format a box's
+        (x1, x2, y1, y2) tuple is its ID
+    """
+    if 'adj_offsets' in mesh:
+        raise ValueError('array meshes are read-only; update the pickled mesh and convert it again')
+
+    boxes = mesh['boxes']
+    adj = mesh['adj']
+    index = mesh['index'] if 'index' in mesh else nm_pathfinder.index_mesh(mesh)
+
+    x1, x2, y1, y2 = rect
+    region = (max(0, x1), min(image.shape[0], x2), max(0, y1), min(image.shape[1], y2))
+    if region[0] >= region[1] or region[2] >= region[3]:
+        return [], []
+
+    def touch(a, b):
+        return a[0] <= b[1] and b[0] <= a[1] and a[2] <= b[3] and b[2] <= a[3]
+
+    touching = nm_pathfinder.query_index(index, region)
+    cut = {boxes[p] for p in touching if max(boxes[p][0], region[0]) < min(boxes[p][1], region[1])
+           and max(boxes[p][2], region[2]) < min(boxes[p][3], region[3])}
+    positions = {boxes[p]: p for p in touching}
+
+    # the pieces of the cut boxes outside the region, the boxes scanned inside it, and a margin of
+    # the old boxes around both are re-cut into as few rectangles as merge_boxes makes, so edits
+    # don't leave slivers behind
+    pieces = [piece for box in cut for piece in cut_box(box, region)]
+    tile_size = int(sqrt((region[1] - region[0]) * (region[3] - region[2]))) + 1
+    scanned, _ = scan_boxes(region, min_feature_size, tiled_classifier(image, tile_size))
+    margin = {neighbor for box in cut for neighbor in adj[box]} | {boxes[p] for p in touching}
+    margin -= cut
+    merged = merge_rectangles(pieces + scanned + list(margin))
+
+    # boxes the re-cut reproduces stay as they are; boxes from merge_halves may overlap, so a
+    # rectangle can also repeat a box outside the margin, which already covers it
+    removed = (cut | margin) - set(merged)
+    added = [box for box in merged if box not in adj]
+
+    # the old boxes the new ones touch, found before the index forgets the removed ones
+    around = set()
+    for box in added:
+        for p in nm_pathfinder.query_index(index, box):
+            if boxes[p] not in removed:
+                around.add(boxes[p])
+                positions[boxes[p]] = p
+
+    # unhook the removed boxes, then hook the new ones to each other and to the old boxes around them
+    for box in removed:
+        for neighbor in adj.pop(box):
+            if neighbor not in removed:
+                adj[neighbor].remove(box)
+                around.add(neighbor)
+
+    new_adj = collections.defaultdict(list)
+    for i, a in enumerate(added):
+        for b in added[i + 1:]:
+            if touch(a, b):
+                new_adj[a].append(b)
+                new_adj[b].append(a)
+        for b in around:
+            if touch(a, b):
+                new_adj[a].append(b)
+                adj[b].append(a)
+
+    adj.update(new_adj)
+    added = list(new_adj.keys())
+
+    for b in around:
+        if not adj[b]:
+            del adj[b]
+            removed.add(b)
+
+    # reuse the positions of removed boxes for added ones, then fill any left over from the end
+    holes = []
+    for box in removed:
+        if box not in positions:
+            positions[box] = next(p for p in nm_pathfinder.query_index(index, box) if boxes[p] == box)
+        holes.append(positions[box])
+    nm_pathfinder.remove_from_index(index, holes)
+    placed = {}
+    for box in added:
+        if holes:
+            position = holes.pop()
+            boxes[position] = box
+        else:
+            boxes.append(box)
+            position = len(boxes) - 1
+        nm_pathfinder.add_to_index(index, [position])
+        placed[box] = position
+
+    for hole in sorted(holes, reverse=True):
+        last = len(boxes) - 1
+        if hole != last:
+            nm_pathfinder.remove_from_index(index, [last])
+            boxes[hole] = boxes[last]
+            nm_pathfinder.add_to_index(index, [hole])
+            placed[boxes[hole]] = hole
+        boxes.pop()
+
+    version = mesh.get('version', 0)
+    mesh['version'] = version + 1
+    nm_pathfinder.patch_search_state(mesh, version, placed, around - removed, removed)
+
+    return added, sorted(removed)
+
+
+def cut_box(box, region):
+    """Returns the parts of box outside region, as at most four boxes: above, below, left and right of it."""
+    x1, x2, y1, y2 = box
+    pieces = []
+    if x1 < region[0]:
+        pieces.append((x1, region[0], y1, y2))
+    if region[1] < x2:
+        pieces.append((region[1], x2, y1, y2))
+    middle = (max(x1, region[0]), min(x2, region[1]))
+    if y1 < region[2]:
+        pieces.append(middle + (y1, region[2]))
+    if region[3] < y2:
+        pieces.append(middle + (region[3], y2))
+    return pieces
+
+
+def open_raw(filename, shape):
+    """Maps a raw file of shape[0] rows of shape[1] uint8 pixels read-only."""
+    return numpy.memmap(filename, dtype=numpy.uint8, mode='r', shape=tuple(shape))
+
+
+def read_png_rows(filename, chunk_size=1 << 16):
+    """
+    Decodes a non-interlaced PNG one row at a time
+
+    Only the first channel is kept (palette images yield their red channel), scaled to 0-255 the
+    way the builder reads images through imread, so memory stays at a couple of rows.
+
+    Yields:
+        The header as (height, width), then each row as a uint8 array
+    """
+
+    with open(filename, 'rb') as f:
+
+        if f.read(8) != PNG_SIGNATURE:
+            raise ValueError('%s is not a PNG file' % filename)
+
+        inflater = zlib.decompressobj()
+        pending = b''
+        prior = None
+        palette = None
+        row = 0
+
+        while True:
+            length, kind = struct.unpack('>I4s', f.read(8))
+
+            if kind == b'IHDR':
+                width, height, depth, color, _, _, interlace = struct.unpack('>IIBBBBB', f.read(length))
+                if interlace or color not in PNG_CHANNELS or depth > 8:
+                    raise ValueError('%s: only non-interlaced PNGs of up to 8 bits per sample are supported' % filename)
+                channels = PNG_CHANNELS[color]
+                bpp = max(1, channels * depth // 8)
+                stride = (width * channels * depth + 7) // 8
+                yield height, width
+
+            elif kind == b'PLTE':
+                palette = numpy.frombuffer(f.read(length), dtype=numpy.uint8).reshape(-1, 3)[:, 0]
+
+            elif kind == b'IDAT':
+                remaining = length
+                while remaining:
+                    data = inflater.unconsumed_tail + f.read(min(remaining, chunk_size))
+                    remaining -= len(data) - len(inflater.unconsumed_tail)
+                    while data:
+                        # cap the output so a highly compressed chunk cannot expand all at once
+                        pending += inflater.decompress(data, chunk_size)
+                        data = inflater.unconsumed_tail
+                        while len(pending) > stride and row < height:
+                            prior = _unfilter_png_row(pending[0], pending[1:stride + 1], prior, bpp)
+                            pending = pending[stride + 1:]
+                            row += 1
+                            yield _png_first_channel(prior, width, channels, depth, color, palette)
+
+            else:
+                f.seek(length, 1)
+                if kind == b'IEND':
+                    break
+
+            f.seek(4, 1)  # chunk CRC
+
+        if row != height:
+            raise ValueError('%s: image data ends after %d of %d rows' % (filename, row, height))
+
+
+def _unfilter_png_row(kind, data, prior, bpp):
+    line = numpy.frombuffer(data, dtype=numpy.uint8)
+    if prior is None:
+        prior = numpy.zeros_like(line)
+
+    if kind == 0:
+        return line.copy()
+    if kind == 1:
+        return numpy.cumsum(line.reshape(-1, bpp), axis=0, dtype=numpy.uint8).ravel()
+    if kind == 2:
+        return line + prior
+
+    # average and paeth depend on the reconstructed byte to the left, so they go byte by byte
+    out = bytearray(data)
+    up = prior.tolist()
+    for i in range(len(out)):
+        left = out[i - bpp] if i >= bpp else 0
+        if kind == 3:
+            out[i] = (out[i] + ((left + up[i]) >> 1)) & 255
+        else:
+            upper_left = up[i - bpp] if i >= bpp else 0
+            p = left + up[i] - upper_left
+            pa, pb, pc = abs(p - left), abs(p - up[i]), abs(p - upper_left)
+            if pa <= pb and pa <= pc:
+                predictor = left
+            elif pb <= pc:
+                predictor = up[i]
+            else:
+                predictor = upper_left
+            out[i] = (out[i] + predictor) & 255
+    return numpy.frombuffer(bytes(out), dtype=numpy.uint8)
+
+
+def _png_first_channel(line, width, channels, depth, color, palette):
+    if depth == 8:
+        values = line.reshape(width, channels)[:, 0]
+    else:
+        shifts = numpy.arange(8 - depth, -1, -depth, dtype=numpy.uint8)
+        values = ((line[:, None] >> shifts) & ((1 << depth) - 1)).ravel()[:width]
+
+    if color == 3:
+        return palette[values]
+    if depth < 8:
+        return (values * (255 // ((1 << depth) - 1))).astype(numpy.uint8)
+    return values
+
+
+def png_to_raw(png_filename, raw_filename):
+    """Streams a PNG into a raw uint8 file for open_raw and returns its (height, width)."""
+    rows = read_png_rows(png_filename)
+    shape = next(rows)
+    with open(raw_filename, 'wb') as f:
+        for line in rows:
+            f.write(line.tobytes())
+    return shape
+
+
+def _build_file(filename, args):
+    """Builds (or fetches from the cache) the mesh, and atlas, of one map for the command line."""
+    min_feature_size = args.min_feature_size
+    tiled = args.tile_size or args.shape
+    mesh_filename = filename + '.mesh.pickle'
+    atlas_filename = None if tiled else filename + '.mesh.png'
+
+    if args.cache:
+        key = nm_meshcache.cache_key(filename, BUILDER_VERSION, min_feature_size=min_feature_size, merge=args.merge,
+                                     shape=args.shape)
+        entry = nm_meshcache.lookup(args.cache, key)
+        if entry is not None and (atlas_filename is None or entry[1] is not None):
+            nm_meshcache.fetch(entry, mesh_filename, atlas_filename)
+            print("Cached mesh for %s." % filename)
+            return
+
+    if tiled:
+
+        raw = None
+        try:
+            if args.shape:
+                shape = tuple(int(v) for v in args.shape.lower().split('x'))
+                raw_filename = filename
+            else:
+                raw = tempfile.NamedTemporaryFile(suffix='.raw', delete=False)
+                raw.close()
+                raw_filename = raw.name
+                shape = png_to_raw(filename, raw_filename)
+
+            img = open_raw(raw_filename, shape)
+            if args.jobs > 1:
+                mesh = build_mesh_parallel(img, min_feature_size, args.jobs, args.tile_size or 1024)
+            else:
+                mesh = build_mesh_tiled(img, min_feature_size, args.tile_size or 1024)
+        finally:
+            if raw is not None:
+                os.unlink(raw.name)
 
-    if len(sys.argv) == 2:
-        filename = sys.argv[1]
-    elif len(sys.argv) == 3:
-        filename = sys.argv[1]
-        min_feature_size = int(sys.argv[2])
     else:
-        print("usage: %s map_filename min_feature_size" % sys.argv[0])
-        sys.exit(-1)
 
-    img = (imread(filename) * 255).astype(dtype=numpy.uint8)
-    if len(img.shape) > 2:
-        img = img[:, :, 0]
+        img = (imread(filename) * 255).astype(dtype=numpy.uint8)
+        if len(img.shape) > 2:
+            img = img[:, :, 0]
 
-    mesh = build_mesh(img, min_feature_size)
+        if args.jobs > 1:
+            mesh = build_mesh_parallel(img, min_feature_size, args.jobs)
+        else:
+            mesh = build_mesh(img, min_feature_size)
 
-    print(type(mesh))
-    print(mesh.keys())
+    if args.merge:
+        before = mesh_counts(mesh)
+        mesh = merge_boxes(mesh)
+        print("Merged %d boxes and %d edges into %d boxes and %d edges." % (before + mesh_counts(mesh)))
 
-    with open(filename + '.mesh.pickle', 'wb') as f:
+    with open(mesh_filename, 'wb') as f:
         pickle.dump(mesh, f, protocol=pickle.HIGHEST_PROTOCOL)
 
-    atlas = zeros_like(img)
-    for x1, x2, y1, y2 in mesh['boxes']:
-        atlas[x1:x2, y1:y2] = random.randint(64, 255)
+    if not tiled:
+        atlas = zeros_like(img)
+        for x1, x2, y1, y2 in mesh['boxes']:
+            atlas[x1:x2, y1:y2] = random.randint(64, 255)
 
-    imsave(filename + '.mesh.png', atlas)
+        imsave(atlas_filename, atlas)
+
+    if args.cache:
+        nm_meshcache.store(args.cache, key, mesh_filename, atlas_filename)
 
     print("Built a mesh with %d boxes." % len(mesh['boxes']))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Builds a navigation mesh from a map image.')
+    parser.add_argument('map_filename', help='a map image, or a directory to build every map image in')
+    parser.add_argument('min_feature_size', nargs='?', type=int, default=16)
+    parser.add_argument('--tile-size', type=int,
+                        help='build with bounded memory, reading at most this many pixels square at a time '
+                             '(PNG maps are first streamed into a temporary raw file); skips the atlas')
+    parser.add_argument('--shape', help='HEIGHTxWIDTH of a raw uint8 map_filename, implies --tile-size')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes to build with')
+    parser.add_argument('--merge', action='store_true',
+                        help='re-cut the built boxes into fewer, larger rectangles')
+    parser.add_argument('--cache', nargs='?', const=nm_meshcache.DEFAULT_CACHE_DIR,
+                        help='reuse meshes built before from the same image and parameters, kept in this '
+                             'directory (default %s)' % nm_meshcache.DEFAULT_CACHE_DIR)
+    parser.add_argument('--cache-max-mb', type=float, help='evict the least recently used cache entries beyond this size')
+    parser.add_argument('--cache-max-days', type=float, help='evict cache entries unused for this long')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.map_filename):
+        filenames = sorted(os.path.join(args.map_filename, name) for name in os.listdir(args.map_filename)
+                           if name.lower().endswith(MAP_EXTENSIONS) and not name.lower().endswith('.mesh.png'))
+    else:
+        filenames = [args.map_filename]
+
+    for filename in filenames:
+        _build_file(filename, args)
+
+    if args.cache and (args.cache_max_mb is not None or args.cache_max_days is not None):
+        removed = nm_meshcache.evict(args.cache,
+                                     None if args.cache_max_mb is None else args.cache_max_mb * 2 ** 20,
+                                     None if args.cache_max_days is None else args.cache_max_days * 86400)
+        print("Evicted %d cache entries." % removed)
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+# Content-addressed cache of built meshes and their atlases, for nm_meshbuilder.
+#
+# An entry is keyed on a hash of the map file's bytes, every parameter that changes the mesh, and
+# the builder version, so an edited image, other parameters or a new builder simply miss. Entries
+# are plain files in one directory, <key>.mesh.pickle and, once an atlas was rendered, <key>.mesh.png,
+# written through a temporary file and renamed so concurrent builds never see half an entry. A hit
+# refreshes the entry's modification time, which eviction goes by.
+
+DEFAULT_CACHE_DIR = os.environ.get('NM_MESH_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'nm_meshbuilder'))
+
+MESH_SUFFIX = '.mesh.pickle'
+ATLAS_SUFFIX = '.mesh.png'
+
+
+def file_digest(filename, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file's contents, read a chunk at a time."""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(map_filename, version, **params):
+    """
+    Returns the cache key of building map_filename with params by builder version
+
+    Args:
+        map_filename: the map image (or raw file) the mesh is built from
+        version: the builder version; bump it whenever the builder's output changes
+        params: every parameter the mesh depends on, e.g. min_feature_size
+    """
+    content = json.dumps({'image': file_digest(map_filename), 'version': version, 'params': params}, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def lookup(cache_dir, key):
+    """
+    Finds a cached entry and marks it as just used
+
+    Returns:
+        The paths of the entry's mesh and atlas (None if it has none), or None on a miss
+    """
+    mesh_path = os.path.join(cache_dir, key + MESH_SUFFIX)
+    atlas_path = os.path.join(cache_dir, key + ATLAS_SUFFIX)
+    try:
+        os.utime(mesh_path)
+    except FileNotFoundError:
+        return None
+    if os.path.exists(atlas_path):
+        os.utime(atlas_path)
+    else:
+        atlas_path = None
+    return mesh_path, atlas_path
+
+
+def store(cache_dir, key, mesh_filename, atlas_filename=None):
+    """Copies a freshly built mesh file, and its atlas if there is one, into the cache."""
+    os.makedirs(cache_dir, exist_ok=True)
+    _copy(mesh_filename, os.path.join(cache_dir, key + MESH_SUFFIX))
+    if atlas_filename is not None:
+        _copy(atlas_filename, os.path.join(cache_dir, key + ATLAS_SUFFIX))
+
+
+def fetch(entry, mesh_filename, atlas_filename=None):
+    """Copies a cached entry (see lookup) to the files a build would have written."""
+    mesh_path, atlas_path = entry
+    _copy(mesh_path, mesh_filename)
+    if atlas_filename is not None and atlas_path is not None:
+        _copy(atlas_path, atlas_filename)
+
+
+def evict(cache_dir, max_bytes=None, max_age=None):
+    """
+    Removes entries unused for longer than max_age seconds, then the least recently used ones
+    until the cache holds at most max_bytes
+
+    Returns:
+        The number of entries removed
+    """
+    entries = {}
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        for suffix in (MESH_SUFFIX, ATLAS_SUFFIX):
+            if name.endswith(suffix):
+                path = os.path.join(cache_dir, name)
+                stat = os.stat(path)
+                entry = entries.setdefault(name[:-len(suffix)], [0, 0, []])
+                entry[0] = max(entry[0], stat.st_mtime)
+                entry[1] += stat.st_size
+                entry[2].append(path)
+
+    now = time.time()
+    total = sum(size for _, size, _ in entries.values())
+    removed = 0
+    for used, size, paths in sorted(entries.values()):
+        if (max_age is None or now - used <= max_age) and (max_bytes is None or total <= max_bytes):
+            continue
+        for path in paths:
+            os.remove(path)
+        total -= size
+        removed += 1
+    return removed
+
+
+def _copy(source, target):
+    # write next to the target and rename, so readers only ever see whole files
+    temporary = '%s.%d.tmp' % (target, os.getpid())
+    try:
+        shutil.copyfile(source, temporary)
+        os.replace(temporary, target)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
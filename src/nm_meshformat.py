@@ -0,0 +1,165 @@
+import pickle
+import sys
+
+import numpy
+
+# A mesh file is a single flat int32 .npy array, so numpy.load(mmap_mode='r') maps all of it at once
+# and every section below is a view into that mapping. Mapping only saves reading the file: the
+# first search copies the sections into per-process lists (nm_pathfinder's index and search state),
+# so a search-ready array mesh takes more memory than its pickle and is no quicker to get ready
+# (test_image: +14.4 MB against +8.6 MB resident, 112 ms against 73 ms).
+#
+#   [MAGIC, FORMAT_VERSION, section_count, (tag, offset, rows, cols) * section_count, section data...]
+#
+# 'boxes' holds one (x1, x2, y1, y2) row per box. Adjacency is CSR-style: the neighbors of box i are
+# adj_indices[adj_offsets[i]:adj_offsets[i + 1]], and the optional 'portals' section holds the shared
+# (x1, x2, y1, y2) boundary segment for each of those entries. The optional landmark sections hold
+# the landmark box positions and a (boxes, landmarks) table of float32 distances stored bit for bit
+# in the int32 array (see nm_landmarks).
+
+MAGIC = 0x4E4D5348
+FORMAT_VERSION = 1
+SECTIONS = ['boxes', 'adj_offsets', 'adj_indices', 'portals', 'landmark_nodes', 'landmark_distances']
+FLOAT_SECTIONS = {'landmark_distances'}
+
+
+def mesh_to_arrays(mesh, portals=False):
+    """
+    Flattens a {'boxes': [...], 'adj': {...}} mesh into int32 arrays
+
+    Args:
+        mesh: a mesh as built by nm_meshbuilder.build_mesh
+        portals: also compute the shared boundary segment of every adjacency
+
+    Returns:
+        A dict of arrays in the layout described at the top of this module; box i is mesh['boxes'][i]
+    """
+    boxes = mesh['boxes']
+    for box in boxes:
+        if any(v != int(v) for v in box):
+            raise ValueError('box %r does not have integer pixel coordinates' % (box,))
+
+    ids = {box: i for i, box in enumerate(boxes)}
+    offsets = numpy.zeros(len(boxes) + 1, dtype=numpy.int32)
+    indices = []
+    for i, box in enumerate(boxes):
+        neighbors = mesh['adj'].get(box, [])
+        indices.extend(ids[n] for n in neighbors)
+        offsets[i + 1] = len(indices)
+
+    arrays = {
+        'boxes': numpy.array(boxes, dtype=numpy.int32).reshape(-1, 4),
+        'adj_offsets': offsets,
+        'adj_indices': numpy.array(indices, dtype=numpy.int32),
+    }
+
+    if portals:
+        b = arrays['boxes']
+        owner = numpy.repeat(numpy.arange(len(boxes)), numpy.diff(offsets))
+        first, second = b[owner], b[arrays['adj_indices']]
+        arrays['portals'] = numpy.stack([
+            numpy.maximum(first[:, 0], second[:, 0]), numpy.minimum(first[:, 1], second[:, 1]),
+            numpy.maximum(first[:, 2], second[:, 2]), numpy.minimum(first[:, 3], second[:, 3]),
+        ], axis=1).astype(numpy.int32)
+
+    if 'landmarks' in mesh:
+        landmarks = mesh['landmarks']
+        arrays['landmark_nodes'] = numpy.array([ids[box] for box in landmarks['nodes']], dtype=numpy.int32)
+        arrays['landmark_distances'] = numpy.array(landmarks['distances'], dtype=numpy.float32).reshape(len(boxes), -1)
+
+    return arrays
+
+
+def save_mesh(arrays, filename):
+    """
+    Writes mesh arrays (see mesh_to_arrays) to filename as one flat int32 .npy file
+    """
+    sections = []
+    for name in SECTIONS:
+        if name in arrays:
+            if name in FLOAT_SECTIONS:
+                data = numpy.ascontiguousarray(arrays[name], dtype=numpy.float32).view(numpy.int32)
+            else:
+                data = numpy.ascontiguousarray(arrays[name], dtype=numpy.int32)
+            sections.append((SECTIONS.index(name), data))
+
+    header_size = 3 + 4 * len(sections)
+    header = [MAGIC, FORMAT_VERSION, len(sections)]
+    offset = header_size
+    for tag, data in sections:
+        rows = data.shape[0]
+        cols = data.shape[1] if data.ndim > 1 else 1
+        header.extend([tag, offset, rows, cols])
+        offset += data.size
+
+    flat = numpy.empty(offset, dtype=numpy.int32)
+    flat[:header_size] = header
+    offset = header_size
+    for tag, data in sections:
+        flat[offset:offset + data.size] = data.ravel()
+        offset += data.size
+
+    with open(filename, 'wb') as f:
+        numpy.save(f, flat)
+
+
+def load_mesh(filename, mmap=True):
+    """
+    Loads a mesh file
+
+    Args:
+        filename: an array mesh (.npy) written by save_mesh, or a legacy .mesh.pickle
+        mmap: map the array file read-only instead of reading it; searching still copies the
+            arrays into per-process lists, so this saves no memory once the mesh is searched
+
+    Returns:
+        For .npy files, a dict of array views into the file; otherwise the unpickled mesh dict
+    """
+    if not filename.endswith('.npy'):
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+    flat = numpy.load(filename, mmap_mode='r' if mmap else None)
+    if flat.dtype != numpy.int32 or flat.ndim != 1 or flat.size < 3 or flat[0] != MAGIC:
+        raise ValueError('%s is not an array mesh file' % filename)
+    if flat[1] != FORMAT_VERSION:
+        raise ValueError('%s has mesh format version %d, expected %d' % (filename, flat[1], FORMAT_VERSION))
+
+    mesh = {}
+    for s in range(int(flat[2])):
+        tag, offset, rows, cols = (int(v) for v in flat[3 + 4 * s:7 + 4 * s])
+        data = flat[offset:offset + rows * cols]
+        if SECTIONS[tag] in FLOAT_SECTIONS:
+            data = data.view(numpy.float32)
+        mesh[SECTIONS[tag]] = data.reshape(rows, cols) if cols > 1 else data
+
+    return mesh
+
+
+def convert(pickle_filename, npy_filename, portals=False):
+    with open(pickle_filename, 'rb') as f:
+        mesh = pickle.load(f)
+    arrays = mesh_to_arrays(mesh, portals)
+    save_mesh(arrays, npy_filename)
+    return arrays
+
+
+if __name__ == '__main__':
+
+    args = [a for a in sys.argv[1:] if a != '--portals']
+
+    if len(args) not in (1, 2):
+        print("usage: %s map.mesh.pickle [map.mesh.npy] [--portals]" % sys.argv[0])
+        sys.exit(-1)
+
+    source = args[0]
+    if len(args) == 2:
+        target = args[1]
+    elif source.endswith('.pickle'):
+        target = source[:-len('.pickle')] + '.npy'
+    else:
+        target = source + '.npy'
+
+    arrays = convert(source, target, '--portals' in sys.argv)
+
+    print("Wrote %s: %d boxes, %d adjacencies." % (target, len(arrays['boxes']), len(arrays['adj_indices'])))
@@ -0,0 +1,71 @@
+from collections import OrderedDict
+
+import nm_pathfinder
+
+
+class PathCache:
+    """
+    Size-bounded LRU cache of box corridors for nm_pathfinder.find_path and find_paths
+
+    Entries are keyed on (start, goal) box IDs plus the search options that shape the corridor
+    (see nm_pathfinder.search), and hold the corridor of boxes the search chose, so a hit only
+    has to rebuild the waypoints for the query's exact endpoints. A corridor found with one
+    weight or heuristic is never served to a query asking for another. Queries with no path are
+    cached too. The cache remembers which mesh, and which mesh['version'] of it, its
+    entries came from (see nm_pathfinder.mesh_stamp); nm_meshbuilder.update_mesh bumps the version, so any edit, or switching
+    to another mesh, empties the cache before a stale corridor can be served.
+
+    Args:
+        maxsize: the most corridors kept; the least recently used one is evicted beyond that
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stamp = None
+        self._corridors = OrderedDict()
+
+    def __len__(self):
+        return len(self._corridors)
+
+    def sync(self, mesh):
+        """Drops every entry if mesh is not the mesh, or mesh version, the entries were cached for."""
+        stamp = nm_pathfinder.mesh_stamp(mesh)
+        if stamp != self.stamp:
+            if self._corridors:
+                self.invalidations += 1
+            self._corridors.clear()
+            self.stamp = stamp
+
+    def get(self, start, goal, options=()):
+        """
+        Returns the cached corridor from start to goal found with options, () if there is no path,
+        or None on a miss
+        """
+        key = (start, goal, options)
+        corridor = self._corridors.get(key)
+        if corridor is None:
+            self.misses += 1
+            return None
+        self._corridors.move_to_end(key)
+        self.hits += 1
+        return corridor
+
+    def put(self, start, goal, corridor, options=()):
+        key = (start, goal, options)
+        self._corridors[key] = tuple(corridor)
+        self._corridors.move_to_end(key)
+        if len(self._corridors) > self.maxsize:
+            self._corridors.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._corridors.clear()
+
+    def info(self):
+        """Counters as a dict, for logging or export."""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'invalidations': self.invalidations, 'size': len(self._corridors), 'maxsize': self.maxsize}
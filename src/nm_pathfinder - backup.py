@@ -1,3 +1,7 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
 def find_path (source_point, destination_point, mesh):
     """
     Searches for a path from source_point to destination_point through the mesh
@@ -19,24 +23,21 @@ def find_path (source_point, destination_point, mesh):
     for box in mesh["boxes"]:
         if box[0] <= source_point[0] and box[1] >= source_point[0] and box[2] <= source_point[1] and box[3] >= source_point[1]:
             boxes['start'] = box
-            print(f'debug: start - {box}')
+            logger.debug('start - %s', box)
         if box[0] <= destination_point[0] and box[1] >= destination_point[0] and box[2] <= destination_point[1] and box[3] >= destination_point[1]:
             boxes['goal'] = box
-            print(f'debug: goal - {box}')
+            logger.debug('goal - %s', box)
     def breadth_first_search (start, goal, graph, adj):
         count = 0
-        print('debug 1')
         queue = [start]
         prevs = {start: None}
         detail_points = {start: source_point}
         linePath = [destination_point]
         while queue:
-            print('debug 2')
             current_node = queue.pop(0)
             if current_node == goal:
                 linePath.append(destination_point)
-                print('debug 4')
-                print('Path!')
+                logger.debug('Path!')
                 #returnPath = []
                 while current_node != start:
                     boxes[current_node] = count
@@ -44,12 +45,11 @@ def find_path (source_point, destination_point, mesh):
                 #    returnPath.append((current_node[0], current_node[1], current_node[2], current_node[3]))
                     current_node = prevs[current_node]
                     linePath.insert(0, detail_points[current_node])
-                    print(f'debug: inserted {detail_points[current_node]}')
+                    logger.debug('inserted %s', detail_points[current_node])
                 #returnPath.append(start)
                 return linePath
                 #return returnPath
             else:
-                print('debug 3')
                 for new in adj[current_node]:
                     if new not in prevs:
                         prevs[new] = current_node
@@ -73,12 +73,12 @@ def find_path (source_point, destination_point, mesh):
                         #linePath.append((dx, dy))
                         #print(f'new point: {dx}, {dy}')
 
-        print('No path!')
+        logger.info('No path!')
         return linePath
         #returnPath = []
         #return returnPath
 
     path = breadth_first_search(boxes['start'], boxes['goal'], mesh["boxes"], mesh["adj"])
         
-    print(boxes.keys())
+    logger.debug('explored %s', boxes.keys())
     return path, boxes.keys()
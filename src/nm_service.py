@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+from math import isfinite
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import nm_meshformat
+import nm_pathfinder
+from nm_client import HEADER, MAX_MESSAGE, encode_message, parse_address
+
+# A long-running path query service (protocol in nm_client).
+#
+# Meshes are loaded once, by every worker process; each worker holds its own index and search state,
+# even for memory-mapped array meshes (see nm_pathfinder.search_state). Queries from all connections
+# go into one queue; the collector takes whatever has arrived, waits max_delay for more if that is
+# less than a batch, and hands each group of queries for the same mesh and options to the pool as
+# one find_paths call.
+
+# the find_path options a query may set, and the values each accepts
+OPTIONS = {'bidirectional': lambda value: isinstance(value, bool),
+           'smooth': lambda value: isinstance(value, bool),
+           'weight': lambda value: _is_number(value) and isfinite(value) and value > 0,
+           'heuristic': lambda value: isinstance(value, str) and (value in nm_pathfinder.HEURISTICS or value == 'landmarks')}
+
+_meshes = {}
+
+
+def _init_worker(filenames):
+    for name, filename in filenames.items():
+        mesh = nm_meshformat.load_mesh(filename)
+        nm_pathfinder.index_mesh(mesh)
+        nm_pathfinder.search_state(mesh)
+        _meshes[name] = mesh
+
+
+def _search_batch(name, pairs, options):
+    # a query that fails, despite validation, fails alone: the batch is retried one query at a time
+    try:
+        results = nm_pathfinder.find_paths(pairs, _meshes[name], **options)
+    except Exception:
+        return [_search_one(name, pair, options) for pair in pairs]
+    return [(path, len(explored), None) for path, explored in results]
+
+
+def _search_one(name, pair, options):
+    try:
+        path, explored = nm_pathfinder.find_path(pair[0], pair[1], _meshes[name], **options)
+    except Exception as error:
+        return None, 0, '%s: %s' % (type(error).__name__, error)
+    return path, len(explored), None
+
+
+def check_query(query, meshes):
+    """
+    Validates a query before it joins a batch
+
+    Returns:
+        The name of the mesh to search, the (source_point, destination_point) pair and the options
+
+    Raises:
+        ValueError: the query is malformed
+    """
+    if not isinstance(query, dict):
+        raise ValueError('a query must be a JSON object')
+
+    name = query.get('mesh')
+    if name is None and len(meshes) == 1:
+        name = next(iter(meshes))
+    if name not in meshes:
+        raise ValueError('unknown mesh %r' % name)
+
+    pair = []
+    for field in ('source', 'destination'):
+        point = query.get(field)
+        if not isinstance(point, list) or len(point) != 2 or not all(_is_number(v) and isfinite(v) for v in point):
+            raise ValueError('%s must be a list of two finite numbers' % field)
+        pair.append(tuple(point))
+
+    options = {}
+    for option, value in query.items():
+        if option in ('id', 'mesh', 'source', 'destination'):
+            continue
+        if option not in OPTIONS:
+            raise ValueError('unknown option %r' % option)
+        if not OPTIONS[option](value):
+            raise ValueError('bad value %r for %s' % (value, option))
+        options[option] = value
+
+    return name, tuple(pair), options
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class PathService:
+    """
+    Answers path queries on preloaded meshes in batches
+
+    Args:
+        filenames: mesh name to mesh file, loaded by every worker
+        workers: number of worker processes, or 0 to search on one thread of this process
+        batch_size: the most queries handed to a worker at once
+        max_delay: seconds the collector waits for a batch to fill up
+    """
+
+    def __init__(self, filenames, workers=0, batch_size=64, max_delay=0.002):
+        self.filenames = dict(filenames)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.queue = None
+        self.executor = None
+        self.tasks = set()
+
+    async def start(self):
+        if self.workers:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.filenames,))
+        else:
+            _init_worker(self.filenames)
+            self.executor = ThreadPoolExecutor(1)  # one search at a time: search state is per mesh
+        # load every worker now rather than on the first queries
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, len, ()) for _ in range(max(self.workers, 1))))
+        self.queue = asyncio.Queue()
+        self.limit = asyncio.Semaphore(max(self.workers, 1) * 2)
+        self._spawn(self._collect())
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def find_path(self, query):
+        """Queues one query (a dict as nm_client sends it) and returns its answer."""
+        name, pair, options = check_query(query, self.filenames)
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(((name, json.dumps(options, sort_keys=True)), pair, future))
+        path, explored, error = await future
+        if error is not None:
+            return {'error': error}
+        return {'path': path, 'explored': explored}
+
+    async def _collect(self):
+        while True:
+            batch = [await self.queue.get()]
+            if self.queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.max_delay)
+            while not self.queue.empty() and len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+
+            groups = {}
+            for key, pair, future in batch:
+                groups.setdefault(key, []).append((pair, future))
+            for key, entries in groups.items():
+                await self.limit.acquire()
+                self._spawn(self._run(key, entries))
+
+    async def _run(self, key, entries):
+        name, options = key
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _search_batch, name, [pair for pair, _ in entries], json.loads(options))
+        except Exception as error:
+            for _, future in entries:
+                if not future.done():
+                    future.set_exception(error)
+        else:
+            for (_, future), result in zip(entries, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.limit.release()
+
+    async def handle(self, reader, writer):
+        """Serves one connection, answering its queries as they complete."""
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                size, = HEADER.unpack(header)
+                if size > MAX_MESSAGE:
+                    break
+                self._spawn(self._answer(await reader.readexactly(size), writer))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _answer(self, body, writer):
+        query = {}
+        try:
+            query = json.loads(body)
+            answer = await self.find_path(query)
+        except Exception as error:
+            answer = {'error': '%s: %s' % (type(error).__name__, error)}
+        answer['id'] = query.get('id') if isinstance(query, dict) else None
+        if not writer.is_closing():
+            writer.write(encode_message(answer))
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+
+async def serve(address, filenames, workers=0, batch_size=64, max_delay=0.002):
+    """Runs a PathService on address (see nm_client.parse_address) until SIGTERM or SIGINT."""
+    service = PathService(filenames, workers, batch_size, max_delay)
+    await service.start()
+
+    address = parse_address(address)
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.remove(address)
+        server = await asyncio.start_unix_server(service.handle, address)
+    else:
+        server = await asyncio.start_server(service.handle, *address)
+
+    # stop cleanly on SIGTERM and SIGINT, so the socket file is removed
+    stopped = asyncio.get_running_loop().create_future()
+    for number in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(number, lambda: stopped.done() or stopped.set_result(None))
+
+    print("Serving %s on %s with %d workers." % (', '.join(filenames), address, workers))
+    try:
+        async with server:
+            await stopped
+    finally:
+        service.close()
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Serves path queries on preloaded meshes.')
+    parser.add_argument('meshes', nargs='+', metavar='[NAME=]MESH',
+                        help='mesh files (.mesh.npy or .mesh.pickle) to serve, named by their file name by default')
+    parser.add_argument('--address', default='127.0.0.1:8765',
+                        help='unix:PATH or a socket path, or HOST:PORT (default %(default)s)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='worker processes; 0 searches on a thread of the service')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--max-delay-ms', type=float, default=2, help='how long a batch may wait to fill up')
+    args = parser.parse_args()
+
+    filenames = {}
+    for spec in args.meshes:
+        name, _, filename = spec.rpartition('=')
+        filenames[name or os.path.basename(filename)] = filename
+
+    asyncio.run(serve(args.address, filenames, args.workers, args.batch_size, args.max_delay_ms / 1000))
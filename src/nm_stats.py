@@ -0,0 +1,91 @@
+from collections import deque
+from heapq import heappop, heappush
+from math import sqrt
+from time import perf_counter
+
+
+class SearchStats:
+    """
+    Per-query search counters and timings for nm_pathfinder.find_path and find_paths, and the maze
+    Dijkstra (dijkstras_shortest_path)
+
+    Searches given a SearchStats route their heap pushes and pops through it; searches without one
+    call heapq directly and do no extra work, so leaving stats off costs nothing. Each query ends in a
+    record with its expansions, heap pushes, stale pops (entries left behind by a cheaper route),
+    peak open-set size, point-location and search time in seconds, and path length and waypoint
+    count. Records are summed into totals (see info), the last keep of them are held in records,
+    and each is handed to sink, e.g. a logger or metrics exporter.
+
+    Args:
+        keep: how many of the latest records to hold
+        sink: an optional function called with each record
+    """
+
+    FIELDS = ('expansions', 'pushes', 'stale_pops', 'locate_time', 'search_time', 'path_length', 'waypoints')
+
+    def __init__(self, keep=1024, sink=None):
+        self.sink = sink
+        self.records = deque(maxlen=keep)
+        self.queries = 0
+        self.found = 0
+        self.cached = 0
+        self.totals = dict.fromkeys(self.FIELDS, 0)
+        self.peak_open = 0
+        self.begin()
+
+    def begin(self, locate_time=0.0):
+        """Starts a query; locate_time is what finding its start and goal took."""
+        self.pushes = self.pops = self.stale_pops = self.open_size = 0
+        self.locate_time = locate_time
+        self.started = perf_counter()
+
+    def push(self, queue, item):
+        heappush(queue, item)
+        self.pushes += 1
+        if len(queue) > self.open_size:
+            self.open_size = len(queue)
+
+    def pop(self, queue):
+        self.pops += 1
+        return heappop(queue)
+
+    def finish(self, path, path_length=None, cached=False):
+        """
+        Ends the query begun last and records it
+
+        Args:
+            path: the path found, empty if there is none
+            path_length: the path's cost; by default its length through its points
+
+        Returns:
+            The record
+        """
+        if path_length is None:
+            path_length = sum(sqrt((b[0] - a[0]) ** 2 + (b[1] - a[1]) ** 2) for a, b in zip(path, path[1:]))
+        record = {'expansions': self.pops - self.stale_pops, 'pushes': self.pushes, 'stale_pops': self.stale_pops,
+                  'peak_open': self.open_size, 'locate_time': self.locate_time,
+                  'search_time': perf_counter() - self.started,
+                  'path_length': path_length, 'waypoints': len(path), 'found': bool(path), 'cached': cached}
+
+        self.queries += 1
+        self.found += record['found']
+        self.cached += cached
+        for field in self.FIELDS:
+            self.totals[field] += record[field]
+        if record['peak_open'] > self.peak_open:
+            self.peak_open = record['peak_open']
+        self.records.append(record)
+        if self.sink is not None:
+            self.sink(record)
+        return record
+
+    def info(self):
+        """Totals over every query recorded, as a dict, for logging or export."""
+        info = {'queries': self.queries, 'found': self.found, 'cached': self.cached, 'peak_open': self.peak_open}
+        info.update(self.totals)
+        return info
+
+    def clear(self):
+        self.records.clear()
+        self.queries = self.found = self.cached = self.peak_open = 0
+        self.totals = dict.fromkeys(self.FIELDS, 0)
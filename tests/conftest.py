@@ -0,0 +1,8 @@
+import os
+import sys
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+INPUT_DIR = os.path.join(SOURCE_DIR, '..', 'input')
+
+sys.path.insert(0, SOURCE_DIR)
+sys.path.insert(0, os.path.join(SOURCE_DIR, 'Dijkstra Forward Search'))
@@ -0,0 +1,51 @@
+import os
+import random
+
+import pytest
+
+from conftest import SOURCE_DIR
+from Dijkstra_forward_search import (dijkstras_shortest_path, dijkstras_shortest_path_grid, jump_point_search_grid,
+                                     navigation_edges, transition_cost)
+from maze_environment import load_level, level_to_grid
+
+
+def _random_level(width, height, seed):
+    # walled in, with a quarter of the inside blocked and most of the rest plain cost-1 cells for JPS to jump across
+    rnd = random.Random(seed)
+    walls = set()
+    spaces = {}
+    for i in range(width):
+        for j in range(height):
+            if i in (0, width - 1) or j in (0, height - 1) or rnd.random() < 0.25:
+                walls.add((i, j))
+            else:
+                spaces[i, j] = 1. if rnd.random() < 0.6 else float(rnd.randint(2, 9))
+    return {'walls': walls, 'spaces': spaces, 'waypoints': {}}
+
+
+def _cost(level, path):
+    return sum(transition_cost(level, cell, cell2) for cell, cell2 in zip(path, path[1:]))
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_grid_searches_match_dijkstra_costs(seed):
+    if seed == 0:
+        level = load_level(os.path.join(SOURCE_DIR, 'Dijkstra Forward Search', 'example.txt'))
+    else:
+        level = _random_level(40, 30, seed)
+    grid = level_to_grid(level)
+    cells = sorted(level['spaces'])
+
+    rnd = random.Random(seed)
+    for _ in range(30):
+        src, dst = rnd.sample(cells, 2)
+        expected = dijkstras_shortest_path(src, dst, level, navigation_edges)
+        for search in (dijkstras_shortest_path_grid, jump_point_search_grid):
+            path = search(src, dst, grid)
+            if not expected:
+                assert path is False
+                continue
+            assert path[0] == src and path[-1] == dst
+            assert all(max(abs(x2 - x1), abs(y2 - y1)) == 1 and cell2 in level['spaces']
+                       for (x1, y1), cell2 in zip(path, path[1:]) for x2, y2 in [cell2])
+            assert _cost(level, path) == pytest.approx(_cost(level, expected), rel=1e-6)
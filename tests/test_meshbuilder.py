@@ -0,0 +1,118 @@
+import os
+import random
+
+import numpy
+import pytest
+from matplotlib.pyplot import imread
+from PIL import Image
+
+import nm_meshbuilder
+import nm_pathfinder
+from conftest import INPUT_DIR
+
+MAPS = ['homer.png', 'ucsc_banana_slug.png', 'test_image.png']
+
+
+def test_mixed_box_too_small_to_cut():
+    # a 2x2 checkerboard can't be cut in two along either side; this used to split forever
+    image = numpy.array([[255, 0], [0, 255]], dtype=numpy.uint8)
+    for min_feature_size in (1, 2, 4):
+        assert nm_meshbuilder.build_mesh(image, min_feature_size) == {'boxes': [], 'adj': {}}
+        assert nm_meshbuilder.build_mesh_tiled(image, min_feature_size, tile_size=1) == {'boxes': [], 'adj': {}}
+
+
+def test_thin_mixed_strip():
+    image = numpy.full((2, 9), 255, dtype=numpy.uint8)
+    image[0, 4] = 0
+    mesh = nm_meshbuilder.build_mesh(image, 1)
+    for x1, x2, y1, y2 in mesh['boxes']:
+        assert (image[x1:x2, y1:y2] == 255).all()
+
+
+def _map_image(filename):
+    # the way _build_file reads a map that fits in memory
+    image = (imread(filename) * 255).astype(numpy.uint8)
+    return image[:, :, 0] if image.ndim > 2 else image
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB', 'RGBA', 'LA', '1', 'P'])
+def test_png_rows_match_imread(tmp_path, mode):
+    rnd = numpy.random.default_rng(0)
+    pixels = numpy.where(rnd.random((37, 53)) < 0.5, 0, 255).astype(numpy.uint8)
+    pixels[:5] = rnd.integers(0, 256, (5, 53))  # a few grey rows too
+    rgb = numpy.stack([pixels, 255 - pixels, pixels // 2], axis=2)
+    image = Image.fromarray(rgb, 'RGB')
+    if mode == 'P':
+        image = image.quantize(64)
+    else:
+        image = image.convert(mode)
+    filename = str(tmp_path / 'map.png')
+    image.save(filename)
+
+    raw_filename = str(tmp_path / 'map.raw')
+    shape = nm_meshbuilder.png_to_raw(filename, raw_filename)
+    assert shape == (37, 53)
+    assert numpy.array_equal(nm_meshbuilder.open_raw(raw_filename, shape), _map_image(filename))
+
+
+@pytest.mark.parametrize('name', MAPS)
+def test_tiled_and_parallel_builds_match(tmp_path, name):
+    image = _map_image(os.path.join(INPUT_DIR, name))
+    expected = nm_meshbuilder.build_mesh(image, 16)
+
+    raw_filename = str(tmp_path / 'map.raw')
+    image.tofile(raw_filename)
+    mapped = nm_meshbuilder.open_raw(raw_filename, image.shape)
+
+    for mesh in (nm_meshbuilder.build_mesh_tiled(mapped, 16, tile_size=200),
+                 nm_meshbuilder.build_mesh_parallel(mapped, 16, jobs=2, tile_size=200),
+                 nm_meshbuilder.build_mesh_parallel(image, 16, jobs=2)):
+        assert sorted(mesh['boxes']) == sorted(expected['boxes'])
+        assert {box: sorted(neighbors) for box, neighbors in mesh['adj'].items()} == \
+            {box: sorted(neighbors) for box, neighbors in expected['adj'].items()}
+
+
+@pytest.mark.parametrize('name', MAPS)
+def test_update_mesh_keeps_invariants(name):
+    image = _map_image(os.path.join(INPUT_DIR, name))
+    mesh = nm_meshbuilder.build_mesh(image, 16)
+    nm_pathfinder.index_mesh(mesh)
+    nm_pathfinder.search_state(mesh)
+
+    rnd = random.Random(0)
+    for edit in range(300):
+        x = rnd.randrange(image.shape[0])
+        y = rnd.randrange(image.shape[1])
+        rect = (x, x + rnd.randint(1, 16), y, y + rnd.randint(1, 16))
+        image[rect[0]:rect[1], rect[2]:rect[3]] = rnd.choice((0, 255))
+        added, removed = nm_meshbuilder.update_mesh(mesh, image, rect, 16)
+        assert len(removed) < 50  # an edit only replaces the boxes around it
+        if edit % 50 == 49:
+            _check_mesh(mesh, image)
+
+    # edits don't leave slivers piling up: no more boxes than building the edited map from scratch
+    assert len(mesh['boxes']) <= len(nm_meshbuilder.build_mesh(image, 16)['boxes'])
+
+
+def _check_mesh(mesh, image):
+    boxes, adj = mesh['boxes'], mesh['adj']
+    assert len(set(boxes)) == len(boxes) and set(boxes) == set(adj)
+    for box, neighbors in adj.items():
+        x1, x2, y1, y2 = box
+        assert (image[x1:x2, y1:y2] == 255).all()
+        assert neighbors and box not in neighbors
+        for other in neighbors:
+            assert box in adj[other]
+            assert box[0] <= other[1] and other[0] <= box[1] and box[2] <= other[3] and other[2] <= box[3]
+
+    # the index finds every box, and the patched search state is the one search_state would build
+    for position, box in enumerate(boxes):
+        assert position in nm_pathfinder.query_index(mesh['index'], box)
+    patched = mesh['search']
+    fresh = nm_pathfinder.search_state(dict(mesh, search=None))
+    assert patched['version'] == mesh['version']
+    assert patched['boxes'] == fresh['boxes']
+    for node in range(len(boxes)):
+        assert sorted(zip(patched['adj'][node], patched['portals'][node])) == \
+            sorted(zip(fresh['adj'][node], fresh['portals'][node]))
+    assert all(len(values) == len(boxes) for side in patched['sides'] for values in side.values())
@@ -0,0 +1,29 @@
+import nm_pathfinder
+from nm_pathcache import PathCache
+
+
+def _mesh():
+    boxes = [(0, 10, 0, 10), (0, 10, 10, 20), (0, 10, 20, 30)]
+    return {'boxes': boxes, 'adj': {boxes[0]: [boxes[1]], boxes[1]: [boxes[0], boxes[2]], boxes[2]: [boxes[1]]}}
+
+
+def test_hit_needs_the_same_options():
+    mesh = _mesh()
+    cache = PathCache()
+    first, _ = nm_pathfinder.find_path((5, 5), (5, 25), mesh, cache=cache)
+    again, _ = nm_pathfinder.find_path((5, 5), (5, 25), mesh, cache=cache)
+    assert first == again and cache.hits == 1
+    nm_pathfinder.find_path((5, 5), (5, 25), mesh, cache=cache, weight=5)
+    assert cache.hits == 1 and cache.misses == 2
+
+
+def test_another_mesh_at_the_same_version_misses():
+    cache = PathCache()
+    nm_pathfinder.find_path((5, 5), (5, 25), _mesh(), cache=cache)
+    # a freshly loaded mesh starts at version 0 too, and may even get the freed mesh's id
+    mesh = _mesh()
+    cache.sync(mesh)
+    assert len(cache) == 0 and cache.invalidations == 1
+    nm_pathfinder.find_path((5, 5), (5, 25), mesh, cache=cache)
+    cache.sync(mesh)
+    assert len(cache) == 1
@@ -0,0 +1,40 @@
+import os
+import pickle
+import random
+
+import nm_pathfinder
+from conftest import INPUT_DIR
+
+
+def _homer():
+    with open(os.path.join(INPUT_DIR, 'homer.png.mesh.pickle'), 'rb') as f:
+        return pickle.load(f)
+
+
+def _pairs(mesh, count, seed=0):
+    rnd = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        points = []
+        for _ in range(2):
+            x1, x2, y1, y2 = rnd.choice(mesh['boxes'])
+            points.append((rnd.randint(x1, x2), rnd.randint(y1, y2)))
+        pairs.append(tuple(points))
+    return pairs
+
+
+def test_path_pool_keeps_its_workers_per_mesh_version():
+    mesh = _homer()
+    pairs = _pairs(mesh, 40)
+    expected = nm_pathfinder.find_paths(pairs, mesh)
+
+    with nm_pathfinder.PathPool(2) as pool:
+        assert nm_pathfinder.find_paths(pairs, mesh, workers=pool) == expected
+        executor = pool.executor
+        assert nm_pathfinder.find_paths(pairs, mesh, workers=pool, chunksize=7) == expected
+        assert pool.executor is executor
+
+        mesh['version'] = mesh.get('version', 0) + 1
+        assert nm_pathfinder.find_paths(pairs, mesh, workers=pool) == expected
+        assert pool.executor is not executor
+    assert pool.executor is None